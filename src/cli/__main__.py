@@ -4,16 +4,26 @@
 cloud-geocode
 
 Usage:
-    cli create partitions --input-csv=input-csv [--output-partitions=output-partitions --chunk-size=size --separator=sep --column-names=names...]
+    cli create partitions --input-csv=input-csv [--output-partitions=output-partitions --chunk-size=size --separator=sep --column-names=names... --integer-keys]
     cli create jobs [--input-jobs=input-jobs --output-jobs=output-jobs --single=specific-file]
     cli upload [--bucket=bucket --input-folder=upload-folder --single=specific-file]
-    cli create enhancement-gdb [--output-gdb-folder=output-gdb]
-    cli enhance [--csv-folder=geocoded-results]
-    cli merge [--final-folder=final-folder]
+    cli create enhancement-gdb [--output-gdb-folder=output-gdb --source=workspace --snapshot]
+    cli enhance [--csv-folder=geocoded-results --final-folder=final-folder --full --spatial-sort=curve --store --database=database]
+    cli merge [--final-folder=final-folder --chunk-size=size --workers=count --dedupe]
     cli rename [--csv-folder=geocoded-results]
-    cli post-mortem [--result-folder=input-folder --separator=sep --output-folder=output-folder]
-    cli post-mortem rebase [--result-folder=input-folder --single=specific-file --separator=sep --message=message]
-    cli post-mortem normalize [--unmatched=input-csv --output-normalized=file-path]
+    cli post-mortem [--result-folder=input-folder --separator=sep --output-folder=output-folder --workers=count --memory-budget=mb]
+    cli post-mortem rebase [--result-folder=input-folder --single=specific-file --separator=sep --message=message --workers=count --memory-budget=mb]
+    cli post-mortem normalize [--unmatched=input-csv --output-normalized=file-path --workers=count --cache=cache-file]
+    cli geocode-local [--input-folder=upload-folder --result-folder=input-folder --api-url=url --workers=count --single=specific-file --ignore-failure]
+    cli run --input-csv=input-csv [--column-names=names... --separator=sep --chunk-size=size --cluster=cluster --cluster-command=command --api-url=url --workers=count --timeout=timeout --stop-after=stage --output-partitions=output-partitions --output-jobs=output-jobs --result-folder=input-folder --output-folder=output-folder --final-folder=final-folder --integer-keys]
+    cli store ingest [--database=database --result-folder=input-folder --separator=sep]
+    cli store post-mortem [--database=database --output-folder=output-folder]
+    cli store rebase --single=specific-file [--database=database --result-folder=input-folder --separator=sep --message=message]
+    cli store merge [--database=database --final-folder=final-folder]
+    cli status [--heartbeats=location --stale=seconds --service-account=key]
+    cli plan [--input-folder=upload-folder --plan-folder=plan-folder --sample-size=rows --api-url=url --workers=count --target-hours=hours --seed=seed]
+    cli benchmark generate [--benchmark-folder=folder --rows=size --duplicate-rate=rate --garbage-rate=rate --invalid-zone-rate=rate --unmatched-rate=rate --seed=seed]
+    cli benchmark run [--benchmark-folder=folder --size=size... --case=case... --workers=count]
 
 Arguments:
 --input-jobs=input-jobs                 The parent folder path to the partitioned csv files [default: ./../data/partitioned]
@@ -24,6 +34,7 @@ Arguments:
 --chunk-size=size                       The amount of records to have in each partition [default: 150000]
 --separator=sep                         The csv file field separator [default: ,]
 --column-names=names                    An array of the column names in the csv
+--integer-keys                          Encode the category and partial-id into a single 64 bit integer id instead of concatenating them
 --input-folder=upload-folder            The parent folder path containing the csv files to upload to a bucket [default: ../data/partitioned]
 --bucket=bucket                         The google cloud bucket to upload the files to [default: ut-dts-agrc-geocoding-dev-source]
 --result-folder=input-folder            The input folder containing csv files [default: ./../data/geocoded-results]
@@ -31,32 +42,166 @@ Arguments:
 --unmatched=input-csv                   The path to the not_found.csv file generated from post-mortem or other input [default: ./../data/postmortem/not_found.csv]
 --output-normalized=file-path           The place to store the normalized addresses [default: ./../data/postmortem/normalized.csv]
 --output-gdb-folder=output-gdb          The parent directory of the file geodatabase containing the enhancement layers [default: ./../data/enhanced]
+--source=workspace                      The workspace to copy the enhancement layers from. Defaults to the OpenSGID connection
+--snapshot                              Export a compressed read only copy of the enhancement gdb for enhance to read from
 --csv-folder=geocoded-results           The parent directory of the geocoded files to enhanced [default: ./../data/geocoded-results]
 --final-folder=final-folder             The parent directory of the enhanced csv files [default: ./../data/results]
+--workers=count                         The number of files to process in parallel [default: 1]
+--dedupe                                Drop rows with a type and id that were already merged from another file
+--cache=cache-file                      A json file to store parsed addresses in so they are reused by the next normalize
+--memory-budget=mb                      Stream the result csvs in chunks so the workers together use about this many megabytes. Rebase still holds the matched retry rows in memory
 --message=message                       The message to be used in the rebase command [default: post mortem replaced]
+--full                                  Ignore the stored row hashes and enhance every row
+--spatial-sort=curve                    Order the points along a hilbert or zorder curve and rebuild the spatial index of each enhance step
+--database=database                     The sqlite results store [default: ./../data/results.db]
+--store                                 Also write the enhanced rows into the --database results store for store merge
+--cluster=cluster                       How run geocodes the partitions. kubernetes, local or command [default: kubernetes]
+--api-url=url                           The base url of the web api for local geocoding [default: http://localhost]
+--ignore-failure                        Keep geocoding a file after the continuous failure threshold is passed
+--cluster-command=command               The command run for each partition by the command cluster. {csv} and {output} are replaced with the partition and result paths
+--timeout=timeout                       How long run waits for the kubernetes jobs to complete [default: 24h]
+--stop-after=stage                      The last stage for run to complete. partitions, upload, jobs, geocode, rename, post-mortem, enhance or merge
+--heartbeats=location                   The heartbeats published by the geocode jobs. A gs://bucket/folder or a local folder [default: gs://ut-dts-agrc-geocoding-dev-result/heartbeats]
+--stale=seconds                         The seconds without a heartbeat before a running job is reported dead [default: 300]
+--service-account=key                   The google service account json key. Defaults to gcs-sa.json in the working directory or src
+--plan-folder=plan-folder               The folder for the plan sample, its geocoded results and plan.json [default: ./../data/plan]
+--sample-size=rows                      The number of partitioned rows to geocode for the plan [default: 2000]
+--target-hours=hours                    The hours the cluster should finish the run in [default: 8]
+--benchmark-folder=folder               The folder for the synthetic data and benchmark history [default: ./../data/benchmark]
+--rows=size                             The number of synthetic rows to generate. A number or 10k, 1m or 10m [default: 10k]
+--duplicate-rate=rate                   The fraction of rows that repeat another row's address and zone [default: 0.1]
+--garbage-rate=rate                     The fraction of addresses with a garbage character [default: 0.05]
+--invalid-zone-rate=rate                The fraction of rows with an invalid zone [default: 0.02]
+--unmatched-rate=rate                   The fraction of geocoded rows with an error message [default: 0.1]
+--seed=seed                             The random seed for the synthetic data [default: 0]
+--size=size                             The data sizes to benchmark. A number or 10k, 1m or 10m [default: 10k]
+--case=case                             The benchmarks to run. cleanse, partitions, post-mortem, rebase, normalize or merge. Defaults to all
+
+Global options:
+--profile=report                        Write the wall time, cpu time, peak memory and rows per second of each stage and file to a json report
+--cprofile                              Also write cProfile dumps of the hot functions next to the --profile report
 """
 
 import sys
+from functools import partial
 from pathlib import Path
 
 from docopt import docopt
 
 from .jobs import create_jobs
+from .local import geocode_local
 from .mortem import mortem, rebase, try_standardize_unmatched
-from .partition import create_partitions
+from .partition import create_partitions, rename_results
 from .upload import upload_files
 from .enhance import create_enhancement_gdb, enhance, merge
+from . import benchmark, pipeline, plan, profiling, status, store
 
 
 def main():
     """the main method to be called when the script is invoked
     """
-    args = docopt(__doc__, version='cloud geocoding cli v1.0.0')
+    argv, report, dumps = profiling.split_profile_arguments(sys.argv[1:])
+    args = docopt(__doc__, argv=argv, version='cloud geocoding cli v1.0.0')
+    command = ' '.join(key for key, value in args.items() if not key.startswith('-') and value is True)
+
+    if report:
+        profiling.enable(report, dumps)
+
+    try:
+        with profiling.measure(command):
+            run_command(args)
+    finally:
+        profiling.write_report(command)
+
+
+def _megabytes(value):
+    if value is None:
+        return None
+
+    return float(value)
+
+
+def run_command(args):
+    """runs the cli command
+    """
+    if args['geocode-local']:
+        geocode_local(
+            args['--input-folder'], args['--result-folder'], args['--api-url'], int(args['--workers']),
+            args['--single'], args['--ignore-failure']
+        )
+
+        return
+
+    if args['plan']:
+        plan.plan(
+            args['--input-folder'], args['--plan-folder'], args['--api-url'], int(args['--sample-size']),
+            int(args['--workers']), float(args['--target-hours']), int(args['--seed'])
+        )
+
+        return
+
+    if args['status']:
+        status.status(args['--heartbeats'], int(args['--stale']), args['--service-account'])
+
+        return
+
+    if args['benchmark']:
+        if args['generate']:
+            rows = benchmark.parse_size(args['--rows'])
+            benchmark.generate(
+                Path(args['--benchmark-folder']) / args['--rows'], rows, float(args['--duplicate-rate']),
+                float(args['--garbage-rate']), float(args['--invalid-zone-rate']), float(args['--unmatched-rate']),
+                int(args['--seed'])
+            )
+        elif args['run']:
+            benchmark.run_benchmarks(args['--benchmark-folder'], args['--size'], args['--case'], int(args['--workers']))
+
+        return
+
+    if args['run']:
+        pipeline.run(
+            args['--input-csv'],
+            args['--separator'],
+            args['--column-names'],
+            int(args['--chunk-size']),
+            {
+                'partitions': args['--output-partitions'],
+                'jobs': args['--output-jobs'],
+                'results': args['--result-folder'],
+                'postmortem': args['--output-folder'],
+                'final': args['--final-folder']
+            },
+            cluster=args['--cluster'],
+            options={
+                'command': args['--cluster-command'],
+                'api_url': args['--api-url'],
+                'workers': int(args['--workers']),
+                'timeout': args['--timeout']
+            },
+            stop_after=args['--stop-after'],
+            integer_keys=args['--integer-keys']
+        )
+
+        return
+
+    if args['store']:
+        if args['ingest']:
+            store.ingest(args['--database'], args['--result-folder'], args['--separator'])
+        elif args['post-mortem']:
+            store.export_post_mortem(args['--database'], args['--output-folder'])
+        elif args['rebase']:
+            store.rebase(
+                args['--database'], args['--result-folder'], args['--single'], args['--separator'], args['--message']
+            )
+        elif args['merge']:
+            store.export_all(args['--database'], args['--final-folder'])
+
+        return
 
     if args['create'] and args['partitions']:
         create_partitions(
             args['--input-csv'], args['--output-partitions'], int(args['--chunk-size']), args['--separator'],
-            args['--column-names']
+            args['--column-names'], integer_keys=args['--integer-keys']
         )
 
         return
@@ -67,7 +212,7 @@ def main():
         return
 
     if args['create'] and args['enhancement-gdb']:
-        create_enhancement_gdb(args['--output-gdb-folder'])
+        create_enhancement_gdb(args['--output-gdb-folder'], args['--source'], args['--snapshot'])
 
         return
 
@@ -86,37 +231,44 @@ def main():
         return
 
     if args['rename']:
-        rename_files = Path(args['--csv-folder']).glob('*-partition_*.csv')
-
-        for path in rename_files:
-            partition = path.stem.split("_")[1]
-            character = chr(ord('a') + int(partition))
-            new_name = f'{character}.csv'
-            print(f'renaming {path.stem} to {new_name}')
-
-            path.rename(path.parent / new_name)
+        rename_results(args['--csv-folder'])
 
         return
 
     if args['enhance']:
-        enhance(args['--csv-folder'])
+        on_result = None
+        if args['--store']:
+            on_result = partial(store.write_enhanced, args['--database'])
+
+        enhance(args['--csv-folder'], args['--full'], args['--spatial-sort'], args['--final-folder'], on_result)
 
         return
 
     if args['merge']:
-        merge(args['--final-folder'])
+        merge(args['--final-folder'], int(args['--chunk-size']), int(args['--workers']), args['--dedupe'])
+
+        return
 
     if args['post-mortem'] and args['rebase']:
-        rebase(args['--result-folder'], args['--single'], args['--separator'], args['--message'])
+        rebase(
+            args['--result-folder'], args['--single'], args['--separator'], args['--message'], int(args['--workers']),
+            _megabytes(args['--memory-budget'])
+        )
+
         return
 
     if args['post-mortem'] and args['normalize']:
-        try_standardize_unmatched(args['--unmatched'], args['--output-normalized'])
+        try_standardize_unmatched(
+            args['--unmatched'], args['--output-normalized'], int(args['--workers']), args['--cache']
+        )
 
         return
 
     if args['post-mortem']:
-        mortem(args['--result-folder'], args['--output-folder'], args['--separator'])
+        mortem(
+            args['--result-folder'], args['--output-folder'], args['--separator'], int(args['--workers']),
+            _megabytes(args['--memory-budget'])
+        )
 
         return
 
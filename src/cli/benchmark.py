@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+benchmark.py
+A module that generates synthetic unclaimed property data and times the cli stages against it
+"""
+
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from .enhance import RESULT_CSV_OPTIONS, merge
+from .local import load_geocode_job
+from .mortem import INCOMPLETE, NOT_FOUND, mortem, rebase, try_standardize_unmatched
+from .partition import create_partitions
+
+SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+GENERATE_CHUNK_SIZE = 500000
+RESULT_FILE_SIZE = 150000
+HISTORY = 'history.jsonl'
+SPEC = 'generated.json'
+INPUT_COLUMNS = ['category', 'partial-id', 'address', 'zone']
+RETRY_FILE = 'retry-all_errors_job.csv'
+
+CATEGORIES = ['a', 'b', 'c', 'd', 'e', 'f']
+DIRECTIONS = ['', 'N ', 'S ', 'E ', 'W ', 'NORTH ', 'SOUTH ', 'EAST ', 'WEST ']
+STREET_NAMES = [
+    'MAIN', 'STATE', 'CENTER', 'HIGHLAND', 'REDWOOD', 'BANGERTER', 'UNIVERSITY', 'FOOTHILL', 'WASATCH', 'CANYON',
+    'PIONEER', 'EMIGRATION', 'LINCOLN', 'JORDAN', 'BEARDSLEY', 'MILLCREEK', 'TEMPLE', 'ELM', 'OAK', 'MAPLE'
+]
+STREET_TYPES = ['ST', 'AVE', 'DR', 'RD', 'WAY', 'LN', 'BLVD', 'CIR', 'CT', 'PL']
+GRID_SUFFIXES = [' S', ' N', ' E', ' W', ' SOUTH', ' NORTH', ' EAST', ' WEST']
+UNITS = ['', '', '', ' APT 4', ' # 12', ' UNIT B', ' STE 200', ' 1/2']
+ZIP_CODES = ['84101', '84102', '84103', '84104', '84105', '84106', '84107', '84108', '84111', '84115', '84117',
+             '84120', '84121', '84123', '84601', '84604', '84003', '84020', '84043', '84062', '84401', '84321']
+CITIES = ['SALT LAKE CITY', 'PROVO', 'OGDEN', 'LOGAN', 'SANDY', 'OREM', 'LEHI', 'DRAPER', 'MURRAY', 'ST GEORGE']
+INVALID_ZONES = ['', '00000', '99999', '8410', 'UNKNOWN', 'N/A', '84101-', 'OUT OF STATE']
+GARBAGE = ['#', '%', '?', '/', '&', '.', '*', '(', ')', '!', '@', '$', '\t', '\x0b', 'é', '½', '°']
+API_ERRORS = [
+    "HTTPConnectionPool(host='webapi-api', port=80): Read timed out. (read timeout=5)",
+    "HTTPConnectionPool(host='webapi-api', port=80): Max retries exceeded with url: /api/v1/geocode",
+    'Geocoding service unavailable.',
+]
+INCOMPLETE_ERRORS = [f'{INCOMPLETE}: line 1 column 1 (char 0)']
+MESSAGE_MIX = [(NOT_FOUND, 0.7), (API_ERRORS, 0.15), (INCOMPLETE_ERRORS, 0.15)]
+
+COUNTIES = ['SALT LAKE', 'UTAH', 'DAVIS', 'WEBER', 'WASHINGTON', 'CACHE', 'SUMMIT', 'TOOELE', 'IRON', 'BOX ELDER']
+
+
+def parse_size(size):
+    """converts a size label like 10k or 1m or a number to a row count
+
+    :param size: The size label or number of rows
+    :type size: str
+    :rtype: int
+    """
+    return SIZES.get(str(size).casefold()) or int(size)
+
+
+def _choice(rng, values, rows):
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), rows)]
+
+
+def _streets(rng, rows, garbage_rate):
+    numbers = pd.Series(rng.integers(1, 15000, rows)).astype(str)
+    grid = rng.random(rows) < 0.4
+
+    named = pd.Series(_choice(rng, DIRECTIONS, rows)) + _choice(rng, STREET_NAMES, rows) + ' ' + _choice(
+        rng, STREET_TYPES, rows
+    )
+    #: utah grid addresses like 450 S 700 E
+    numbered = pd.Series(_choice(rng, GRID_SUFFIXES[:4], rows)).str.strip() + ' ' + pd.Series(
+        rng.integers(1, 140, rows) * 50
+    ).astype(str) + _choice(rng, GRID_SUFFIXES, rows)
+
+    streets = numbers + ' ' + numbered.where(grid, named) + _choice(rng, UNITS, rows)
+
+    garbage = rng.random(rows) < garbage_rate
+    positions = (rng.random(rows) * streets.str.len()).astype(int)
+    characters = _choice(rng, GARBAGE, rows)
+
+    streets[garbage] = [
+        street[:position] + character + street[position:]
+        for street, position, character in zip(streets[garbage], positions[garbage], characters[garbage])
+    ]
+
+    return streets
+
+
+def _zones(rng, rows, invalid_zone_rate):
+    zones = pd.Series(_choice(rng, ZIP_CODES, rows))
+    cities = rng.random(rows) < 0.2
+    zones[cities] = _choice(rng, CITIES, int(cities.sum()))
+
+    plus_four = rng.random(rows) < 0.1
+    zones[plus_four & ~cities] = zones[plus_four & ~cities] + '-' + pd.Series(
+        rng.integers(1000, 9999, rows)
+    ).astype(str)[plus_four & ~cities]
+
+    invalid = rng.random(rows) < invalid_zone_rate
+    zones[invalid] = _choice(rng, INVALID_ZONES, int(invalid.sum()))
+
+    return zones
+
+
+def _input_chunks(rows, duplicate_rate, garbage_rate, invalid_zone_rate, seed):
+    """yields the synthetic input rows in chunks so the memory used does not grow with the number of rows
+    """
+    rng = np.random.default_rng(seed)
+    start = 0
+
+    while start < rows:
+        size = min(GENERATE_CHUNK_SIZE, rows - start)
+
+        chunk = pd.DataFrame({
+            'category': _choice(rng, CATEGORIES, size),
+            'partial-id': np.arange(start + 1, start + size + 1),
+            'address': _streets(rng, size, garbage_rate),
+            'zone': _zones(rng, size, invalid_zone_rate),
+        })
+
+        #: the same owner address reported under another id
+        duplicates = np.flatnonzero(rng.random(size) < duplicate_rate)
+        sources = rng.integers(0, size, len(duplicates))
+        chunk.loc[duplicates, ['address', 'zone']] = chunk.loc[sources, ['address', 'zone']].to_numpy()
+
+        yield chunk
+
+        start += size
+
+
+def _messages(rng, rows):
+    messages = np.empty(rows, dtype=object)
+    kinds = rng.choice(len(MESSAGE_MIX), size=rows, p=[weight for _, weight in MESSAGE_MIX])
+
+    for kind, (values, _) in enumerate(MESSAGE_MIX):
+        mask = kinds == kind
+        messages[mask] = values if isinstance(values, str) else _choice(rng, values, int(mask.sum()))
+
+    return messages
+
+
+def _results(rng, chunk, unmatched_rate):
+    """the geocode.py result rows for the input rows with a realistic mix of error messages
+    """
+    rows = len(chunk.index)
+    unmatched = rng.random(rows) < unmatched_rate
+
+    results = pd.DataFrame({
+        'primary_key': chunk['category'] + chunk['partial-id'].astype(str),
+        'input_address': chunk['address'].str.replace('|', ' ', regex=False),
+        'input_zone': chunk['zone'],
+        'score': rng.integers(70, 101, rows).astype(float),
+        'x': rng.uniform(228000, 673000, rows).round(3),
+        'y': rng.uniform(4094000, 4653000, rows).round(3),
+        'message': None,
+    })
+
+    results.loc[unmatched, ['score', 'x', 'y']] = 0
+    results.loc[unmatched, 'message'] = _messages(rng, int(unmatched.sum()))
+
+    return results
+
+
+def _enhanced(rng, results):
+    """the enhanced step rows for the matched result rows
+    """
+    matched = results.loc[results.message.isnull()]
+    rows = len(matched.index)
+
+    return pd.DataFrame({
+        'type': matched.primary_key.str[:1],
+        'id': matched.primary_key.str[1:],
+        'county_name': _choice(rng, COUNTIES, rows),
+        'senate_district': rng.integers(1, 30, rows).astype(str),
+        'house_district': rng.integers(1, 76, rows).astype(str),
+        'census_id': pd.Series(rng.integers(490019751001, 490579402003, rows)).astype(str).to_numpy(),
+    })
+
+
+def generate(
+    output_folder,
+    rows,
+    duplicate_rate=0.1,
+    garbage_rate=0.05,
+    invalid_zone_rate=0.02,
+    unmatched_rate=0.1,
+    seed=0,
+    file_size=RESULT_FILE_SIZE
+):
+    """writes a synthetic input csv and the matching geocoded results, retry results and enhanced csvs
+
+    - `input.csv`: pipe delimited `category`, `partial-id`, `address`, `zone` rows without a header
+    - `geocoded-results`: the result csvs in the format geocode.py writes
+    - `retry-all_errors_job.csv`: a retry result where half of the unmatched rows were found
+    - `results`: the `_step_` csvs in the format enhance writes
+
+    :param output_folder: The folder to write the synthetic data to
+    :type output_folder: Path
+    :param rows: The number of input rows
+    :type rows: int
+    :param duplicate_rate: The fraction of rows that repeat the address and zone of another row
+    :type duplicate_rate: float
+    :param garbage_rate: The fraction of addresses with a garbage character
+    :type garbage_rate: float
+    :param invalid_zone_rate: The fraction of rows with a zone that is not a city or zip code
+    :type invalid_zone_rate: float
+    :param unmatched_rate: The fraction of rows the api did not match
+    :type unmatched_rate: float
+    :param seed: The random seed so the same data is generated each time
+    :type seed: int
+    :param file_size: The number of rows in each result csv
+    :type file_size: int
+    :returns: the generation settings
+    :rtype: dict
+    """
+    output_folder = Path(output_folder)
+    spec = {
+        'rows': rows,
+        'duplicate_rate': duplicate_rate,
+        'garbage_rate': garbage_rate,
+        'invalid_zone_rate': invalid_zone_rate,
+        'unmatched_rate': unmatched_rate,
+        'seed': seed,
+        'file_size': file_size,
+    }
+
+    if (output_folder / SPEC).exists() and json.loads((output_folder / SPEC).read_text(encoding='utf-8')) == spec:
+        print(f'{output_folder} already contains the synthetic data')
+
+        return spec
+
+    if output_folder.exists():
+        shutil.rmtree(output_folder)
+
+    results_folder = output_folder / 'geocoded-results'
+    enhanced_folder = output_folder / 'results'
+    results_folder.mkdir(parents=True)
+    enhanced_folder.mkdir(parents=True)
+
+    print(f'generating {rows} rows in {output_folder}')
+
+    rng = np.random.default_rng(seed + 1)
+    file_index = 0
+    pending = []
+
+    def write_results(frame, index):
+        frame.to_csv(
+            results_folder / f'result_{index}.csv', index=False, encoding='utf-8', quoting=csv.QUOTE_MINIMAL
+        )
+        _enhanced(rng, frame).to_csv(enhanced_folder / f'result_{index}_step_5.csv', **RESULT_CSV_OPTIONS)
+
+    with open(output_folder / 'input.csv', 'w', encoding='utf-8', newline='') as input_csv, \
+            open(output_folder / RETRY_FILE, 'w', encoding='utf-8', newline='') as retry_csv:
+        header = True
+
+        for chunk in _input_chunks(rows, duplicate_rate, garbage_rate, invalid_zone_rate, seed):
+            chunk.to_csv(input_csv, sep='|', header=False, index=False, quoting=csv.QUOTE_NONE, escapechar='\\')
+
+            results = _results(rng, chunk, unmatched_rate)
+
+            found = results.loc[results.message.notnull() & (rng.random(len(results.index)) < 0.5)].copy()
+            found['score'] = 90.0
+            found['x'] = 425000.0
+            found['y'] = 4510000.0
+            found['message'] = None
+            found.to_csv(retry_csv, header=header, index=False, quoting=csv.QUOTE_MINIMAL)
+            header = False
+
+            #: results are cut into files of file_size rows like the geocoded partitions
+            pending.append(results)
+            buffered = pd.concat(pending, ignore_index=True)
+
+            while len(buffered.index) >= file_size:
+                write_results(buffered.iloc[:file_size], file_index)
+                buffered = buffered.iloc[file_size:]
+                file_index += 1
+
+            pending = [buffered]
+
+        if pending and len(pending[0].index):
+            write_results(pending[0], file_index)
+
+    (output_folder / SPEC).write_text(json.dumps(spec, indent=2), encoding='utf-8')
+
+    print(f'wrote {rows} input rows and {len(list(results_folder.glob("*.csv")))} result files')
+
+    return spec
+
+
+def bench_cleanse(data_folder, **_):
+    """cleanse_address and cleanse_zone from geocode.py over every input row
+    """
+    job = load_geocode_job()
+    rows = 0
+
+    for chunk in pd.read_csv(
+        data_folder / 'input.csv',
+        sep='|',
+        header=None,
+        names=INPUT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE,
+        chunksize=GENERATE_CHUNK_SIZE
+    ):
+        for address, zone in zip(chunk.address, chunk.zone):
+            job.cleanse_address(address)
+            job.cleanse_zone(zone)
+
+        rows += len(chunk.index)
+
+    return rows
+
+
+def bench_partitions(data_folder, work_folder, **_):
+    """create_partitions with the default partition size
+    """
+    return create_partitions(data_folder / 'input.csv', work_folder / 'partitioned', 150000, '|', INPUT_COLUMNS)
+
+
+def bench_mortem(data_folder, work_folder, workers):
+    """process_file for every result csv through mortem
+    """
+    mortem(data_folder / 'geocoded-results', work_folder / 'postmortem', ',', workers)
+
+    return _count_rows(data_folder / 'geocoded-results')
+
+
+def setup_rebase(data_folder, work_folder):
+    """copies the result csvs and the retry results into the work folder since rebase rewrites them
+    """
+    results = work_folder / 'geocoded-results'
+    shutil.copytree(data_folder / 'geocoded-results', results)
+    shutil.copy(data_folder / RETRY_FILE, results)
+
+
+def bench_rebase(data_folder, work_folder, workers):
+    """rebase of the retry results into a copy of the result csvs
+    """
+    rebase(work_folder / 'geocoded-results', RETRY_FILE, ',', 'post mortem replaced', workers)
+
+    return _count_rows(data_folder / 'geocoded-results')
+
+
+def setup_normalize(data_folder, work_folder):
+    """writes the post mortem not_found.csv to normalize
+    """
+    mortem(data_folder / 'geocoded-results', work_folder / 'postmortem', ',')
+
+
+def bench_normalize(work_folder, workers, **_):
+    """try_standardize_unmatched of the post mortem not_found.csv
+    """
+    not_found = work_folder / 'postmortem' / 'not_found.csv'
+    try_standardize_unmatched(not_found, work_folder / 'normalized.csv', workers)
+
+    return _count_rows(not_found)
+
+
+def setup_merge(data_folder, work_folder):
+    """copies the enhanced step csvs into the work folder so all.csv is written there
+    """
+    shutil.copytree(data_folder / 'results', work_folder / 'results')
+
+
+def bench_merge(work_folder, workers, **_):
+    """merge of the enhanced step csvs into all.csv
+    """
+    return merge(work_folder / 'results', workers=workers)
+
+
+def _count_rows(path):
+    """the number of rows in a csv with a header or in every csv in a folder
+    """
+    path = Path(path)
+    total = 0
+
+    for result in path.glob('*.csv') if path.is_dir() else [path]:
+        with open(result, 'rb') as data:
+            total += sum(block.count(b'\n') for block in iter(partial(data.read, 1024 * 1024), b'')) - 1
+
+    return total
+
+
+def cpu_seconds():
+    """the cpu time used by this process and its finished child processes so the cases that run in a pool of
+    workers are measured. The child processes are not included on windows
+    """
+    times = os.times()
+
+    return times.user + times.system + times.children_user + times.children_system
+
+
+#: each case is called with the data_folder, work_folder and workers keywords and ignores the ones it does not use
+CASES = {
+    'cleanse': bench_cleanse,
+    'partitions': bench_partitions,
+    'post-mortem': bench_mortem,
+    'rebase': bench_rebase,
+    'normalize': bench_normalize,
+    'merge': bench_merge,
+}
+
+#: the work a case needs done before it is timed
+SETUP = {
+    'rebase': setup_rebase,
+    'normalize': setup_normalize,
+    'merge': setup_merge,
+}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True,
+                                text=True,
+                                check=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _previous(history, case, size):
+    if not history.exists():
+        return None
+
+    runs = [json.loads(line) for line in history.read_text(encoding='utf-8').splitlines() if line]
+    runs = [run for run in runs if run['case'] == case and run['size'] == size]
+
+    return runs[-1] if runs else None
+
+
+def run_benchmarks(benchmark_folder, sizes, cases=None, workers=1):
+    """times each benchmark case against the synthetic data of each size and appends the timings to the history file
+    so they can be compared over time
+
+    :param benchmark_folder: The folder for the synthetic data and the history file
+    :type benchmark_folder: Path
+    :param sizes: The size labels or row counts to benchmark
+    :type sizes: list[str]
+    :param cases: The names of the cases in CASES to run. Defaults to every case
+    :type cases: list[str]
+    :param workers: The number of processes the cases may use
+    :type workers: int
+    :returns: the timings of this run
+    :rtype: list[dict]
+    """
+    benchmark_folder = Path(benchmark_folder)
+    history = benchmark_folder / HISTORY
+    environment = _environment()
+    timings = []
+
+    for size in sizes:
+        rows = parse_size(size)
+        data_folder = benchmark_folder / str(size)
+        spec = generate(data_folder, rows)
+
+        for case in cases or CASES:
+            work_folder = benchmark_folder / 'work'
+
+            if work_folder.exists():
+                shutil.rmtree(work_folder)
+
+            work_folder.mkdir(parents=True)
+
+            if case in SETUP:
+                SETUP[case](data_folder=data_folder, work_folder=work_folder)
+
+            print(f'\nbenchmarking {case} with {rows} rows')
+
+            wall = perf_counter()
+            cpu = cpu_seconds()
+            processed = CASES[case](data_folder=data_folder, work_folder=work_folder, workers=workers)
+            wall = perf_counter() - wall
+
+            timing = dict(
+                environment,
+                date=datetime.now().isoformat(timespec='seconds'),
+                case=case,
+                size=str(size),
+                data=spec,
+                workers=workers,
+                rows=processed,
+                wall_seconds=wall,
+                cpu_seconds=cpu_seconds() - cpu,
+                rows_per_second=processed / wall if wall > 0 else None
+            )
+
+            previous = _previous(history, case, str(size))
+
+            with open(history, 'a', encoding='utf-8') as output:
+                output.write(json.dumps(timing) + '\n')
+
+            timings.append(timing)
+
+            shutil.rmtree(work_folder)
+
+            change = ''
+            if previous is not None and previous['wall_seconds'] > 0:
+                change = f' ({100 * (wall - previous["wall_seconds"]) / previous["wall_seconds"]:+.1f}% since ' \
+                    f'{previous["commit"] or previous["date"]})'
+
+            print(f'{case} {size}: {wall:.2f} seconds, {timing["rows_per_second"] or 0:.0f} rows per second{change}')
+
+    print('\nbenchmark summary')
+    for timing in timings:
+        print(f'  {timing["case"]:<12} {timing["size"]:>6} {timing["wall_seconds"]:>10.2f}s')
+
+    return timings
@@ -10,13 +10,39 @@ try:
 except:
     pass
 import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from queue import Full, Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event
 from timeit import default_timer
+import numpy as np
 import pandas as pd
 
+from .keys import compact_keys, join_keys, split_keys
+from .profiling import measure, profiled
+
 UTM = "PROJCS['NAD_1983_UTM_Zone_12N',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Transverse_Mercator'],PARAMETER['False_Easting',500000.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-111.0],PARAMETER['Scale_Factor',0.9996],PARAMETER['Latitude_Of_Origin',0.0],UNIT['Meter',1.0]];-5120900 -9998100 10000;-100000 10000;-100000 10000;0.001;0.001;0.001;IsHighPrecision"
 
 GDB_NAME = 'enhance.gdb'
+SNAPSHOT_NAME = 'enhance_snapshot.gdb'
+FINGERPRINTS = 'fingerprints.json'
+READ_CHUNK_SIZE = 100000
+ENHANCED_FIELDS = ['county_name', 'senate_district', 'house_district', 'census_id']
+DISTRICT_FIELDS = ['senate_district', 'house_district']
+NULL_VALUES = {'county_name': '', 'senate_district': -1, 'house_district': -1, 'census_id': ''}
+RESULT_COLUMNS = ['type', 'id'] + ENHANCED_FIELDS
+RESULT_CSV_OPTIONS = {'sep': '|', 'header': False, 'index': False, 'encoding': 'utf-8', 'quoting': csv.QUOTE_MINIMAL}
+HASH_FOLDER = 'hashes'
+HASH_STATE = 'state.json'
+#: bump when the hashed columns or how they are read changes so the stored hashes are not compared
+HASH_VERSION = 2
+HASHED_FIELDS = ['score', 'x', 'y', 'message']
+CURVE_ORDER = 16
+#: the key hashes are spilled to 2^DEDUPE_BITS files so one file at a time is held in memory
+DEDUPE_BITS = 6
 
 enhancement_layers = [{
     'table': 'political.senate_districts_2022_to_2032',
@@ -37,87 +63,338 @@ enhancement_layers = [{
 }]
 
 
-def create_enhancement_gdb(parent_folder):
-    """Creates the file geodatabase that will be used to store the enhanced layers
+def create_enhancement_gdb(parent_folder, source=None, snapshot=False):
+    """Creates or refreshes the file geodatabase that will be used to store the enhanced layers. Only the layers
+    whose source fingerprint changed since the last build are copied again.
 
     :param parent_folder: The parent path to the file geodatabase to create
     :type parent_folder: Path
+    :param source: The workspace to copy the layers from. Defaults to the OpenSGID connection
+    :type source: Path
+    :param snapshot: Export a compressed, read only copy of the geodatabase for enhance to read from
+    :type snapshot: bool
     """
     parent_folder = Path(parent_folder)
     gdb_path = parent_folder / GDB_NAME
+    snapshot_path = parent_folder / SNAPSHOT_NAME
 
-    if gdb_path.exists():
-        print(f'{GDB_NAME} exists. deleting and recreating with fresh data')
+    if source is None:
+        source = Path(__file__).parent.parent.parent / 'maps' / 'opensgid.agrc.utah.gov.sde'
 
-        arcpy.management.Delete(str(gdb_path))
+    if not arcpy.Exists(str(gdb_path)):
+        print('creating file geodatabase')
+        start = default_timer()
 
-    print('creating file geodatabase')
-    start = default_timer()
+        arcpy.management.CreateFileGDB(str(parent_folder), GDB_NAME)
 
-    arcpy.management.CreateFileGDB(str(parent_folder), GDB_NAME)
+        print(f'file geodatabase created in {default_timer() - start} seconds')
+    else:
+        print(f'{GDB_NAME} exists. refreshing the layers that changed')
 
-    print(f'file geodatabase created in {default_timer() - start} seconds')
+    changed = add_enhancement_layers(gdb_path, Path(source).resolve())
 
-    add_enhancement_layers(parent_folder / GDB_NAME)
+    if snapshot and (changed > 0 or not arcpy.Exists(str(snapshot_path))):
+        create_snapshot(gdb_path, snapshot_path)
+    elif changed > 0 and arcpy.Exists(str(snapshot_path)):
+        print(f'removing the out of date {SNAPSHOT_NAME}')
 
+        arcpy.management.Delete(str(snapshot_path))
 
-def add_enhancement_layers(output_gdb):
-    """Adds the enhancement layers to the file geodatabase
+
+def add_enhancement_layers(output_gdb, source):
+    """Adds the enhancement layers whose fingerprint changed to the file geodatabase
     :param output_gdb: The path to the file geodatabase to add the enhancement layers to
     :type output_gdb: Path
+    :param source: The workspace containing the enhancement layers
+    :type source: Path
+    :returns: the number of layers that were copied
+    :rtype: int
     """
-    print('adding enhancement layers')
+    print(f'adding enhancement layers from {source}')
     start = default_timer()
 
-    maps = Path(__file__).parent.parent.parent / 'maps'
-    workspace = (maps / 'opensgid.agrc.utah.gov.sde').resolve()
+    fingerprint_file = output_gdb.parent / FINGERPRINTS
+    fingerprints = {}
+    changed = 0
+
+    if fingerprint_file.exists():
+        fingerprints = json.loads(fingerprint_file.read_text(encoding='utf-8'))
 
-    with arcpy.EnvManager(workspace=str(workspace)):
+    with arcpy.EnvManager(workspace=str(source)):
         for layer in enhancement_layers:
             table_start = default_timer()
+            table = _source_table(layer['table'])
+            output = output_gdb / layer['table'].split('.')[1]
+
+            fingerprint = get_fingerprint(table)
+
+            if fingerprints.get(layer['table']) == fingerprint and arcpy.Exists(str(output)):
+                print(f'    {layer["table"]} is unchanged. skipping')
+
+                continue
+
             print(f'    adding {layer["table"]}')
+
+            if arcpy.Exists(str(output)):
+                arcpy.management.Delete(str(output))
+
             mapping = arcpy.FieldMappings()
-            mapping.addTable(layer['table'])
+            mapping.addTable(table)
 
-            fields = arcpy.ListFields(layer['table'])
+            fields = arcpy.ListFields(table)
 
             filter_mapping(mapping, fields, layer)
 
             arcpy.conversion.FeatureClassToFeatureClass(
-                in_features=layer['table'],
-                out_path=str(output_gdb),
-                out_name=layer['table'].split('.')[1],
-                field_mapping=mapping
+                in_features=table, out_path=str(output_gdb), out_name=output.name, field_mapping=mapping
             )
 
+            fingerprints[layer['table']] = fingerprint
+            fingerprint_file.write_text(json.dumps(fingerprints, indent=2), encoding='utf-8')
+            changed += 1
+
             print(f'    {layer["table"]} finished in {default_timer() - table_start} seconds')
 
-    print(f'enhancement layers added in {default_timer() - start} seconds')
+    print(f'{changed} enhancement layers added in {default_timer() - start} seconds')
+
+    return changed
+
+
+def _source_table(table):
+    """local stand-in workspaces like a file geodatabase do not use the schema prefix of the OpenSGID
+    """
+    if arcpy.Exists(table):
+        return table
+
+    return table.split('.')[1]
+
+
+def get_fingerprint(table):
+    """Creates a cheap fingerprint of a source layer to tell if it changed without copying it
+    :param table: The name of the table in the current workspace
+    :type table: str
+    :returns: the row count, extent, field names and last edit date when editor tracking is enabled
+    :rtype: dict
+    """
+    describe = arcpy.da.Describe(table)
+    extent = describe['extent']
+
+    fingerprint = {
+        'count': int(arcpy.management.GetCount(table)[0]),
+        'extent': None,
+        'fields': sorted(field.name.lower() for field in describe['fields']),
+        'last_edit': None,
+    }
+
+    if extent is not None:
+        fingerprint['extent'] = [round(value, 3) for value in (extent.XMin, extent.YMin, extent.XMax, extent.YMax)]
+
+    edited_at = describe.get('editedAtFieldName')
+    if describe.get('editorTrackingEnabled') and edited_at:
+        with arcpy.da.SearchCursor(table, [edited_at], sql_clause=(None, f'ORDER BY {edited_at} DESC')) as cursor:
+            fingerprint['last_edit'] = str(next(cursor, (None,))[0])
+
+    return fingerprint
+
 
+def create_snapshot(gdb_path, snapshot_path):
+    """Exports a compressed, read only copy of the enhancement geodatabase that is quick to read during enhance
+    :param gdb_path: The path to the enhancement file geodatabase
+    :type gdb_path: Path
+    :param snapshot_path: The path to the snapshot file geodatabase to create
+    :type snapshot_path: Path
+    """
+    print(f'creating {snapshot_path.name}')
+    start = default_timer()
+
+    if arcpy.Exists(str(snapshot_path)):
+        arcpy.management.Delete(str(snapshot_path))
+
+    arcpy.management.Copy(str(gdb_path), str(snapshot_path))
+    arcpy.management.CompressFileGeodatabaseData(str(snapshot_path), 'LOSSLESS')
 
-def merge(parent_folder):
-    """Creates a single csv file containing all the enhanced data
+    print(f'snapshot created in {default_timer() - start} seconds')
+
+
+@profiled(item=lambda parent_folder, *_, **__: parent_folder, rows=lambda written: written)
+def merge(parent_folder, chunk_size=READ_CHUNK_SIZE, workers=1, dedupe=False):
+    """Creates a single csv file containing all the enhanced data by streaming each file in chunks so the memory used
+    does not grow with the size of the inputs. Every column is read as a string so values like census ids are
+    written exactly as they were read. With dedupe the duplicate rows are found on disk first and the files are
+    streamed a second time without them.
 
     :param parent_folder: The parent path to the results folder
     :type parent_folder: Path
+    :param chunk_size: The number of rows to read at a time
+    :type chunk_size: int
+    :param workers: The number of files to read in parallel
+    :type workers: int
+    :param dedupe: Drop rows with a type and id that was already written
+    :type dedupe: bool
     """
     parent_folder = Path(parent_folder)
 
     address_csv_files = sorted(parent_folder.glob('*_step_*.csv'))
+    destination = parent_folder / 'all.csv'
+    temp = destination.with_suffix('.csv.tmp')
 
-    frames = []
+    print(f'merging {len(address_csv_files)} files into {destination}')
 
-    #: read all csv's delimiter='|', quoting=csv.QUOTE_MINIMAL
-    for address_csv_file in address_csv_files:
-        temp = pd.read_csv(
-            address_csv_file, sep='|', encoding='utf-8', names=['type', 'id', 'county', 'senate', 'house', 'census']
-        )
+    duplicates = np.empty(0, dtype=np.uint64)
+    if dedupe:
+        duplicates = find_duplicate_rows(address_csv_files, chunk_size, workers, parent_folder)
+
+    row = 0
+    written = 0
+
+    with open(temp, 'w', encoding='utf-8', newline='') as output:
+        for chunk in _stream_results(address_csv_files, chunk_size, workers):
+            rows = len(chunk.index)
+
+            if len(duplicates):
+                #: the duplicates are sorted so the ones in this chunk are a slice
+                first, last = np.searchsorted(duplicates, [row, row + rows])
+                keep = np.ones(rows, dtype=bool)
+                keep[(duplicates[first:last] - np.uint64(row)).astype(np.int64)] = False
+                chunk = chunk.loc[keep]
+
+            row += rows
+
+            chunk.to_csv(output, **RESULT_CSV_OPTIONS)
+            written += len(chunk.index)
+
+    temp.replace(destination)
 
-        frames.append(temp)
+    print(f'wrote {written} rows to {destination.name}')
+
+    if dedupe:
+        print(f'  dropped {len(duplicates)} duplicate rows')
+
+    return written
+
+
+def find_duplicate_rows(result_csv_files, chunk_size, workers, parent_folder):
+    """finds the position of every row with a type and id that an earlier row already had. The 64 bit hash and
+    position of each key are spilled to files split by the high bits of the hash so the memory used is a
+    fraction of the rows instead of growing with them
+
+    :param result_csv_files: The enhanced csvs in merge order
+    :type result_csv_files: list[Path]
+    :param chunk_size: The number of rows to read at a time
+    :type chunk_size: int
+    :param workers: The number of files to read in parallel
+    :type workers: int
+    :param parent_folder: The folder to spill the key hashes to
+    :type parent_folder: Path
+    :returns: the sorted positions of the duplicate rows
+    :rtype: np.ndarray
+    """
+    spill_folder = Path(mkdtemp(prefix='.dedupe-', dir=parent_folder))
+    buckets = [spill_folder / f'{bucket}.bin' for bucket in range(1 << DEDUPE_BITS)]
+    duplicates = []
+    row = 0
+
+    try:
+        for chunk in _stream_results(result_csv_files, chunk_size, workers):
+            hashes = pd.util.hash_pandas_object(chunk[['type', 'id']], index=False).to_numpy()
+            positions = np.arange(row, row + len(hashes), dtype=np.uint64)
+            bucket_of = hashes >> np.uint64(64 - DEDUPE_BITS)
+            row += len(hashes)
+
+            for bucket in np.unique(bucket_of):
+                in_bucket = bucket_of == bucket
+
+                with open(buckets[bucket], 'ab') as spill:
+                    np.column_stack((hashes[in_bucket], positions[in_bucket])).tofile(spill)
+
+        for bucket in buckets:
+            if not bucket.exists():
+                continue
 
-    #: merge all csv's
-    merged = pd.concat(frames)
-    merged.to_csv(parent_folder / 'all.csv', sep='|', header=False, index=False, encoding='utf-8')
+            pairs = np.fromfile(bucket, dtype=np.uint64).reshape(-1, 2)
+
+            #: the first row for a type and id wins
+            order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+            hashes, positions = pairs[order, 0], pairs[order, 1]
+
+            duplicates.append(positions[1:][hashes[1:] == hashes[:-1]])
+    finally:
+        rmtree(spill_folder)
+
+    if not duplicates:
+        return np.empty(0, dtype=np.uint64)
+
+    return np.sort(np.concatenate(duplicates))
+
+
+def _read_result_chunks(result_csv, chunk_size):
+    return pd.read_csv(
+        result_csv,
+        sep='|',
+        header=None,
+        names=RESULT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+        encoding='utf-8',
+        quoting=csv.QUOTE_MINIMAL,
+        chunksize=chunk_size
+    )
+
+
+def _stream_results(result_csv_files, chunk_size, workers):
+    """yields the chunks of every result file in file order. with more than one worker the next files are read
+    ahead in threads into small bounded queues so at most a few chunks per worker are held in memory
+    """
+    if workers <= 1:
+        for result_csv in result_csv_files:
+            yield from _read_result_chunks(result_csv, chunk_size)
+
+        return
+
+    stop = Event()
+
+    def put(chunks, item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+
+                return True
+            except Full:
+                continue
+
+        return False
+
+    def read_ahead(result_csv, chunks):
+        try:
+            for chunk in _read_result_chunks(result_csv, chunk_size):
+                if not put(chunks, chunk):
+                    return
+        except Exception as ex:
+            put(chunks, ex)
+
+        put(chunks, None)
+
+    queues = [Queue(maxsize=2) for _ in result_csv_files]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result_csv, chunks in zip(result_csv_files, queues):
+            executor.submit(read_ahead, result_csv, chunks)
+
+        try:
+            for chunks in queues:
+                while True:
+                    chunk = chunks.get()
+
+                    if chunk is None:
+                        break
+
+                    if isinstance(chunk, Exception):
+                        raise chunk
+
+                    yield chunk
+        finally:
+            #: let blocked readers exit if the merge stops early
+            stop.set()
 
 
 def filter_mapping(mapping, fields, table_metadata):
@@ -155,11 +432,21 @@ def filter_mapping(mapping, fields, table_metadata):
             mapping.replaceFieldMap(index, field_map)
 
 
-def enhance(parent_folder):
-    """enhances the csv table data from the identity tables
+def enhance(parent_folder, full=False, spatial_sort=None, final_folder=None, on_result=None):
+    """enhances the csv table data from the identity tables. Files that were enhanced before are compared to their
+    stored row hashes and only the changed primary keys are enhanced and patched into the results.
 
     :param parent_folder: The parent path to the csv files to enhance
     :type parent_folder: Path
+    :param full: Ignore the stored row hashes and enhance every row
+    :type full: bool
+    :param spatial_sort: The name of the curve in SPATIAL_SORTS to order the points by before the overlays
+    :type spatial_sort: str
+    :param final_folder: The folder to write the enhanced csvs to. Defaults to data/results
+    :type final_folder: Path
+    :param on_result: An optional function called with each enhanced csv, the rows written to it and the stale
+        primary keys when the rows were patched into it
+    :type on_result: function
     """
     parent_folder = Path(parent_folder).resolve()
     address_csv_files = sorted(parent_folder.glob('*.csv'))
@@ -168,83 +455,422 @@ def enhance(parent_folder):
 
     data = Path(__file__).parent.parent.parent / 'data'
     workspace = (data / 'enhanced' / GDB_NAME).resolve()
+    results = data / 'results'
+
+    if final_folder is not None:
+        results = Path(final_folder)
+        results.mkdir(parents=True, exist_ok=True)
+    hash_folder = data / 'enhanced' / HASH_FOLDER
+    hash_folder.mkdir(exist_ok=True)
+
+    state_file = hash_folder / HASH_STATE
+    state = {}
+
+    if state_file.exists():
+        state = json.loads(state_file.read_text(encoding='utf-8'))
+
+    #: the rows that did not change still hold the values of the layers they were enhanced with
+    layers = read_fingerprints(data / 'enhanced' / FINGERPRINTS)
 
     arcpy.env.workspace = str(workspace)
 
+    identity_workspace = workspace
+    snapshot = (data / 'enhanced' / SNAPSHOT_NAME).resolve()
+
+    if arcpy.Exists(str(snapshot)):
+        print(f'reading enhancement layers from {SNAPSHOT_NAME}')
+        identity_workspace = snapshot
+
+    total_rows = 0
+    total_points = 0
+
     for address_csv in address_csv_files:
-        job = enhance_data(address_csv)
+        table_name = address_csv.stem
+        result_csv = results / f'{table_name}_step_{len(enhancement_layers) + 1}.csv'
+        hash_file = hash_folder / f'{table_name}.csv'
+
+        print(f'0. reading matched addresses from {table_name}')
+        matched, hashes = read_matched_rows(address_csv)
+        print(f'   dropped {len(hashes.index) - len(matched.index)} unmatched rows of {len(hashes.index)}')
+
+        current = {'version': HASH_VERSION, 'layers': layers}
+        refresh = full or state.get(table_name) != current
+
+        if refresh and not full and hash_file.exists():
+            print('   the enhancement layers or row hashes changed since the last enhancement. enhancing every row')
+
+        if refresh or not hash_file.exists() or not result_csv.exists():
+            #: the point_id of a left over step table belongs to the points of another run
+            remove_tables(f'{table_name}_step_*')
+
+            job, keys = enhance_data(table_name, matched, identity_workspace, spatial_sort)
+
+            rows = join_attributes(job, keys)
+            rows.to_csv(result_csv, **RESULT_CSV_OPTIONS)
+            remove_temp_tables(job)
+
+            if on_result is not None:
+                on_result(result_csv, rows, None)
+        else:
+            previous = pd.read_csv(hash_file, dtype={'primary_key': str, 'hash': 'uint64'})
+            #: the stored keys are compared as the same type as the keys that were just read
+            previous = previous.astype({'primary_key': hashes.primary_key.dtype})
+            stale = find_changed_keys(hashes, previous)
+
+            if stale.empty:
+                print('   no rows changed since the last enhancement. skipping')
+
+                continue
+
+            print(f'   {len(stale.index)} rows changed since the last enhancement')
+
+            delta_name = f'{table_name}_delta'
+            remove_tables(f'{delta_name}_step_*')
+
+            delta = matched.loc[matched.primary_key.isin(stale)].copy()
+            keys = pd.DataFrame(columns=['primary_key', 'point_id'])
+            patch = pd.DataFrame(columns=RESULT_COLUMNS)
+
+            if not delta.empty:
+                job, keys = enhance_data(delta_name, delta, identity_workspace, spatial_sort)
+                patch = join_attributes(job, keys)
+
+            patch_results(result_csv, patch, stale)
+
+            if (results / 'all.csv').exists():
+                patch_results(results / 'all.csv', patch, stale)
+
+            remove_tables(f'{delta_name}_step_*')
+
+            if on_result is not None:
+                on_result(result_csv, patch, stale)
+
+        hashes.to_csv(hash_file, index=False, encoding='utf-8')
 
-        prepare_output(job)
-        convert_to_csv(job)
-        remove_temp_tables(job)
+        state[table_name] = current
+        state_file.write_text(json.dumps(state, indent=2), encoding='utf-8')
 
+        total_rows += len(keys.index)
+        total_points += keys['point_id'].nunique()
 
-def enhance_data(address_csv):
-    """enhance the data in the csv file
+    print(f'\nenhanced {total_rows} matched rows using {total_points} unique coordinates')
+    print(f'  deduplication ratio: {_ratio(total_rows, total_points):.2f}x')
+
+
+def read_fingerprints(fingerprint_file):
+    """reads the fingerprints of the enhancement layers written by create_enhancement_gdb
+
+    :param fingerprint_file: The path to fingerprints.json
+    :type fingerprint_file: Path
+    :rtype: dict
     """
-    table_name = address_csv.stem
+    if not fingerprint_file.exists():
+        return {}
 
-    print(f'1. creating points from csv as {table_name}')
+    return json.loads(fingerprint_file.read_text(encoding='utf-8'))
 
-    if not arcpy.Exists(f'{table_name}_step_1'):
-        arcpy.management.MakeXYEventLayer(
-            table=str(address_csv),
-            in_x_field='x',
-            in_y_field='y',
-            out_layer=f'{table_name}_temp',
-            spatial_reference=UTM,
-            in_z_field=None
+
+def _ratio(rows, points):
+    if points == 0:
+        return 0
+
+    return rows / points
+
+
+def read_matched_rows(address_csv, chunk_size=READ_CHUNK_SIZE):
+    """streams the geocoded csv, hashing every row and keeping only the matched rows. The hashed columns are read
+    as text so the same row hashes the same no matter what the rest of its chunk contains
+
+    :param address_csv: The path to the geocoded csv file
+    :type address_csv: Path
+    :param chunk_size: The number of rows to read at a time
+    :type chunk_size: int
+    :returns: a tuple of the matched rows and the content hash of every row
+    :rtype: tuple(pd.DataFrame, pd.DataFrame)
+    """
+    frames = []
+    hashes = []
+
+    for chunk in pd.read_csv(
+        address_csv,
+        encoding='utf-8',
+        usecols=['primary_key'] + HASHED_FIELDS,
+        dtype=str,
+        chunksize=chunk_size
+    ):
+        hashes.append(
+            pd.DataFrame({
+                'primary_key': chunk.primary_key,
+                'hash': pd.util.hash_pandas_object(chunk[HASHED_FIELDS], index=False)
+            })
         )
-    else:
-        print('    skipping')
 
-    print('   creating feature class')
+        score = pd.to_numeric(chunk.score, errors='coerce')
+        matched = chunk.loc[(score > 0) & chunk.message.isnull(), ['primary_key', 'x', 'y']]
+
+        frames.append(matched.astype({'x': 'float64', 'y': 'float64'}))
+
+    if not frames:
+        return pd.DataFrame(columns=['primary_key', 'x', 'y']), pd.DataFrame(columns=['primary_key', 'hash'])
+
+    matched = pd.concat(frames, ignore_index=True)
+    hashes = pd.concat(hashes, ignore_index=True)
+
+    #: integer encoded keys are joined and compared as int64 instead of text
+    matched['primary_key'] = compact_keys(matched.primary_key)
+    hashes['primary_key'] = compact_keys(hashes.primary_key)
+
+    return matched, hashes
+
+
+def dedupe_coordinates(matched):
+    """collapses the matched rows to their unique x, y coordinates so the spatial work is done once per location
+
+    :param matched: The matched rows from read_matched_rows
+    :type matched: pd.DataFrame
+    :returns: a tuple of every primary key with its point_id and the unique points to enhance
+    :rtype: tuple(pd.DataFrame, pd.DataFrame)
+    """
+    #: ngroup with sort is deterministic so the point ids are stable across resumed runs
+    matched['point_id'] = matched.groupby(['x', 'y'], sort=True).ngroup()
+
+    points = matched.groupby('point_id', sort=True).agg(x=('x', 'first'), y=('y', 'first'))
+    points.reset_index(inplace=True)
+
+    return matched[['primary_key', 'point_id']], points
+
+
+def _grid(x, y, order):
+    """scales the coordinates to integer cells of a 2^order by 2^order grid over their extent
+    """
+    cells = (1 << order) - 1
+
+    def scale(values):
+        low = values.min()
+        extent = values.max() - low
+
+        if extent == 0:
+            return np.zeros(len(values), dtype=np.int64)
+
+        return ((values - low) / extent * cells).astype(np.int64)
+
+    return scale(np.asarray(x, dtype=float)), scale(np.asarray(y, dtype=float))
+
+
+def hilbert_index(x, y, order=CURVE_ORDER):
+    """the distance of each coordinate along a hilbert curve covering the extent of the coordinates
+
+    :param x: The x coordinates
+    :type x: np.ndarray
+    :param y: The y coordinates
+    :type y: np.ndarray
+    :param order: The number of bits of each grid dimension
+    :type order: int
+    :rtype: np.ndarray
+    """
+    x, y = _grid(x, y, order)
+    side = 1 << order
+    distance = np.zeros(len(x), dtype=np.int64)
+    size = side >> 1
+
+    while size > 0:
+        rx = (x & size) > 0
+        ry = (y & size) > 0
+        distance += size * size * ((3 * rx) ^ ry)
+
+        #: rotate the quadrant so the curve stays continuous
+        rotate = ~ry
+        flip = rotate & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(rotate, y, x), np.where(rotate, x, y)
+
+        size >>= 1
+
+    return distance
+
+
+def _spread_bits(values):
+    values = values.astype(np.uint64)
+
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+
+    return values
+
+
+def morton_index(x, y, order=CURVE_ORDER):
+    """the distance of each coordinate along a z-order curve covering the extent of the coordinates
+
+    :param x: The x coordinates
+    :type x: np.ndarray
+    :param y: The y coordinates
+    :type y: np.ndarray
+    :param order: The number of bits of each grid dimension
+    :type order: int
+    :rtype: np.ndarray
+    """
+    x, y = _grid(x, y, order)
+
+    return (_spread_bits(x) | (_spread_bits(y) << np.uint64(1))).astype(np.int64)
+
+
+SPATIAL_SORTS = {'hilbert': hilbert_index, 'zorder': morton_index}
+
+
+def sort_points(points, curve):
+    """orders the points along a space filling curve so points that are close together are stored together
+
+    :param points: The unique points from dedupe_coordinates
+    :type points: pd.DataFrame
+    :param curve: The name of the curve in SPATIAL_SORTS
+    :type curve: str
+    :rtype: pd.DataFrame
+    """
+    distance = SPATIAL_SORTS[curve](points.x.to_numpy(), points.y.to_numpy())
+
+    return points.iloc[np.argsort(distance, kind='stable')]
+
+
+def add_spatial_index(feature_class):
+    """rebuilds the spatial index of the feature class with a grid size calculated from its points
+    """
+    start = default_timer()
+
+    with measure('spatial index', feature_class):
+        arcpy.management.AddSpatialIndex(feature_class, 0, 0, 0)
+
+    print(f'   spatial index built in {default_timer() - start}')
+
+
+def find_changed_keys(current, previous):
+    """compares the row hashes of a geocoded file with the hashes stored at the last enhancement
+
+    :param current: The primary key and hash of every row in the geocoded file
+    :type current: pd.DataFrame
+    :param previous: The primary key and hash of every row at the last enhancement
+    :type previous: pd.DataFrame
+    :returns: the primary keys that were added, removed or modified
+    :rtype: pd.Series
+    """
+    #: nullable integers keep the 64 bit hashes exact when the outer join introduces missing rows
+    compared = current.astype({'hash': 'UInt64'}).merge(
+        previous.astype({'hash': 'UInt64'}), on='primary_key', how='outer', suffixes=('', '_previous')
+    )
+    changed = (compared.hash != compared.hash_previous).fillna(True).astype(bool)
+
+    return compared.loc[changed, 'primary_key']
+
+
+def patch_results(result_csv, patch, stale):
+    """replaces the rows of the stale primary keys in an enhanced csv with the patched rows
+
+    :param result_csv: The path to the enhanced csv to patch
+    :type result_csv: Path
+    :param patch: The enhanced rows of the changed primary keys
+    :type patch: pd.DataFrame
+    :param stale: The primary keys that changed
+    :type stale: pd.Series
+    """
+    print(f'patching {len(patch.index)} rows into {result_csv.name}')
+
+    data = pd.read_csv(
+        result_csv, sep='|', header=None, names=RESULT_COLUMNS, dtype=str, keep_default_na=False, encoding='utf-8'
+    )
+
+    data = data.loc[~join_keys(data.type, data.id, pd.api.types.is_integer_dtype(stale)).isin(stale)]
+
+    pd.concat([data, patch]).to_csv(result_csv, **RESULT_CSV_OPTIONS)
+
+
+def remove_tables(wild_card):
+    """deletes the point feature classes matching the wild card so they are not reused by a resumed run
+
+    :param wild_card: The arcpy wild card of the feature classes to delete
+    :type wild_card: str
+    """
+    for table in arcpy.ListFeatureClasses(wild_card=wild_card, feature_type='Point'):
+        arcpy.management.Delete(table)
+
+
+@profiled(item=lambda table_name, *_, **__: table_name, rows=lambda result: len(result[1].index))
+def enhance_data(table_name, matched, identity_workspace, spatial_sort=None):
+    """enhance the unique matched coordinates
+
+    :param table_name: The name prefix of the feature classes to create
+    :type table_name: str
+    :param matched: The matched rows to enhance from read_matched_rows
+    :type matched: pd.DataFrame
+    :param identity_workspace: The enhancement geodatabase or its read only snapshot to read the identity layers from
+    :type identity_workspace: Path
+    :param spatial_sort: The name of the curve in SPATIAL_SORTS to order the points by and index each step with
+    :type spatial_sort: str
+    :returns: a tuple of the final feature class name and the primary keys joined to their point_id
+    :rtype: tuple(str, pd.DataFrame)
+    """
+    keys, points = dedupe_coordinates(matched)
+    print(
+        f'   {len(keys.index)} rows share {len(points.index)} coordinates '
+        f'({_ratio(len(keys.index), len(points.index)):.2f}x)'
+    )
+
+    print(f'1. creating points from unique coordinates as {table_name}')
 
     if not arcpy.Exists(f'{table_name}_step_1'):
-        arcpy.management.XYTableToPoint(
-            in_table=f'{table_name}_temp',
-            out_feature_class=f'{table_name}_step_1',
-            x_field='x',
-            y_field='y',
-            z_field=None,
-            coordinate_system=UTM
-        )
-    else:
-        print('    skipping')
+        start = default_timer()
 
-    print('   selecting match addresses')
+        if spatial_sort:
+            with measure(f'{spatial_sort} sort', table_name):
+                points = sort_points(points, spatial_sort)
 
-    if not arcpy.Exists(f'{table_name}_step_2'):
-        arcpy.management.SelectLayerByAttribute(
-            in_layer_or_view=f'{table_name}_step_1', selection_type='NEW_SELECTION', where_clause='score>0'
-        )
-    else:
-        print('    skipping')
+            print(f'   sorted along a {spatial_sort} curve in {default_timer() - start}')
+
+        points_csv = Path(arcpy.env.scratchFolder) / f'{table_name}_points.csv'
+        points.to_csv(points_csv, index=False, encoding='utf-8')
+
+        with measure('create points', table_name) as record:
+            arcpy.management.XYTableToPoint(
+                in_table=str(points_csv),
+                out_feature_class=f'{table_name}_step_1',
+                x_field='x',
+                y_field='y',
+                z_field=None,
+                coordinate_system=UTM
+            )
+            record['rows'] = len(points.index)
+
+        points_csv.unlink()
 
-    print('   separating matched addresses')
+        if spatial_sort:
+            add_spatial_index(f'{table_name}_step_1')
 
-    if not arcpy.Exists(f'{table_name}_step_2'):
-        arcpy.management.CopyFeatures(in_features=f'{table_name}_step_1', out_feature_class=f'{table_name}_step_2')
+        print(f'completed: {default_timer() - start}')
     else:
         print('    skipping')
 
-    step = 2
+    step = 1
     for identity in enhancement_layers:
         start = default_timer()
         fields = "'".join(identity['fields'])
-        print(f'{step}. enhancing data with {fields} from {identity["table"]}')
+        print(f'{step + 1}. enhancing data with {fields} from {identity["table"]}')
 
         enhance_table_name = identity['table'].split('.')[1]
 
         if not arcpy.Exists(f'{table_name}_step_{step + 1}'):
-            arcpy.analysis.Identity(
-                in_features=f'{table_name}_step_{step}',
-                identity_features=enhance_table_name,
-                out_feature_class=f'{table_name}_step_{step + 1}',
-                join_attributes='NO_FID',
-                cluster_tolerance=None,
-                relationship='NO_RELATIONSHIPS'
-            )
+            with measure(f'identity {enhance_table_name}', table_name) as record:
+                arcpy.analysis.Identity(
+                    in_features=f'{table_name}_step_{step}',
+                    identity_features=str(identity_workspace / enhance_table_name),
+                    out_feature_class=f'{table_name}_step_{step + 1}',
+                    join_attributes='NO_FID',
+                    cluster_tolerance=None,
+                    relationship='NO_RELATIONSHIPS'
+                )
+                record['rows'] = len(points.index)
+
+            if spatial_sort:
+                add_spatial_index(f'{table_name}_step_{step + 1}')
         else:
             print('    skipping')
             step = step + 1
@@ -254,49 +880,36 @@ def enhance_data(address_csv):
         step = step + 1
         print(f'completed: {default_timer() - start}')
 
-    return f'{table_name}_step_{step}'
+    return f'{table_name}_step_{step}', keys
 
 
-def prepare_output(table):
-    """prepares the output by splitting the primary key and the other field
-    """
-    print('adding type field')
-
-    absolute_table = str(Path(arcpy.env.workspace) / table)
-
-    fields = arcpy.ListFields(absolute_table)
-    if 'type' in [field.name.lower() for field in fields]:
-        print('    skipping')
-        return
+@profiled(item=lambda table, *_, **__: table, rows=lambda output: len(output.index))
+def join_attributes(table, keys):
+    """joins the enhanced points back to every primary key in the result csv format
 
-    arcpy.management.AddField(absolute_table, 'type', 'TEXT', '', '', '1')
-
-    print('splitting type and id')
-    arcpy.management.CalculateField(
-        in_table=table, field='type', expression='left($feature.primary_key, 1)', expression_type='ARCADE'
-    )
+    :param table: The name of the final enhanced point feature class
+    :type table: str
+    :param keys: The primary keys with their point_id from dedupe_coordinates
+    :type keys: pd.DataFrame
+    :returns: the type, id and enhanced fields for every primary key
+    :rtype: pd.DataFrame
+    """
+    print(f'reading {table} attributes')
 
-    arcpy.management.CalculateField(
-        in_table=table, field='primary_key', expression='mid($feature.primary_key, 1, 20)', expression_type='ARCADE'
+    attributes = pd.DataFrame(
+        arcpy.da.TableToNumPyArray(
+            in_table=table, field_names=['point_id'] + ENHANCED_FIELDS, skip_nulls=False, null_value=NULL_VALUES
+        )
     )
 
+    for field in DISTRICT_FIELDS:
+        attributes[field] = attributes[field].mask(attributes[field] == NULL_VALUES[field]).astype('Int64')
 
-def convert_to_csv(table):
-    """writes table to csv
-    """
-    print(f'writing {table} to csv')
-
-    destination = Path(__file__).parent.parent.parent / 'data' / 'results' / f'{table}.csv'
+    output = keys.merge(attributes, on='point_id', how='inner', sort=False)
 
-    with arcpy.da.SearchCursor(
-        in_table=table,
-        field_names=['type', 'primary_key', 'county_name', 'senate_district', 'house_district', 'census_id'],
-        where_clause='message is null'
-    ) as cursor, open(destination, 'w', encoding='utf-8', newline='') as result_file:
-        writer = csv.writer(result_file, delimiter='|', quoting=csv.QUOTE_MINIMAL)
+    output['type'], output['id'] = split_keys(output.primary_key)
 
-        for row in cursor:
-            writer.writerow(row)
+    return output[RESULT_COLUMNS]
 
 
 def remove_temp_tables(table):
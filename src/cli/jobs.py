@@ -8,6 +8,9 @@ A module that creates the container metadata for it's job
 from pathlib import Path
 from string import Template
 
+UPLOAD_BUCKET = 'ut-dts-agrc-geocoding-dev-source'
+RESULTS_BUCKET = 'ut-dts-agrc-geocoding-dev-result'
+
 JOB_TEMPLATE = Template(
     """
 apiVersion: batch/v1
@@ -89,8 +92,8 @@ def create_jobs(input_path, output_path, specific_file=None):
             yml.write(
                 JOB_TEMPLATE.substitute({
                     'job_number': i,
-                    'upload_bucket': 'ut-dts-agrc-geocoding-dev-source',
-                    'results_bucket': 'ut-dts-agrc-geocoding-dev-result',
+                    'upload_bucket': UPLOAD_BUCKET,
+                    'results_bucket': RESULTS_BUCKET,
                     'csv_name': path.name,
                     'id_field': 'id',
                     'address_field': 'address',
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+keys.py
+A module that encodes the category and partial id of a primary key into a single 64 bit integer
+"""
+
+import pandas as pd
+
+#: the category character code is stored in the high bits and the partial id in the low 56 bits
+CATEGORY_SHIFT = 56
+ID_MASK = (1 << CATEGORY_SHIFT) - 1
+MAX_CATEGORY = 127
+ENCODED_MINIMUM = 1 << CATEGORY_SHIFT
+
+
+def encode_keys(categories, partial_ids):
+    """combines the category and partial id of each row into an integer key
+
+    :param categories: The single character categories
+    :type categories: pd.Series
+    :param partial_ids: The numeric ids within each category
+    :type partial_ids: pd.Series
+    :returns: the encoded keys
+    :rtype: pd.Series
+    """
+    if categories.isna().any():
+        raise ValueError(f'integer keys require a category on every row. {categories.isna().sum()} are empty')
+
+    if not (categories.astype(str).str.len() == 1).all():
+        raise ValueError('integer keys require single character categories')
+
+    ids = pd.to_numeric(pd.Series(partial_ids, index=categories.index), errors='coerce')
+
+    if ids.isna().any():
+        raise ValueError(f'integer keys require a numeric partial id on every row. {ids.isna().sum()} are not numbers')
+
+    if (ids % 1 != 0).any():
+        raise ValueError('integer keys require whole number partial ids')
+
+    codes = categories.astype(str).map(ord).astype('int64')
+
+    if (codes > MAX_CATEGORY).any():
+        raise ValueError(f'integer keys require categories with a character code of {MAX_CATEGORY} or less')
+
+    if (ids < 0).any() or (ids > ID_MASK).any():
+        raise ValueError(f'integer keys require partial ids between 0 and {ID_MASK}')
+
+    return codes * ENCODED_MINIMUM + ids.astype('int64')
+
+
+def is_encoded(primary_keys):
+    """if the primary keys look like they were created by encode_keys. This is a heuristic, not a flag: the keys are
+    read as encoded when every key is a number of at least 2^56. Data whose own numeric keys reach 2^56 would be
+    read as encoded, so keep those keys as text with a category prefix
+
+    :param primary_keys: The primary keys as numbers or text
+    :type primary_keys: pd.Series
+    :rtype: bool
+    """
+    if len(primary_keys) == 0:
+        return False
+
+    numeric = pd.to_numeric(pd.Series(primary_keys), errors='coerce')
+
+    return bool(numeric.notna().all() and (numeric >= ENCODED_MINIMUM).all())
+
+
+def compact_keys(primary_keys):
+    """converts encoded primary keys read as text to int64 so they are compared and indexed as integers.
+    Other keys are returned unchanged
+
+    :param primary_keys: The primary keys
+    :type primary_keys: pd.Series
+    :rtype: pd.Series
+    """
+    if not is_encoded(primary_keys):
+        return primary_keys
+
+    return pd.to_numeric(primary_keys).astype('int64')
+
+
+def split_keys(primary_keys):
+    """splits the primary keys into the category character and the id text used in the enhanced csvs
+
+    :param primary_keys: The concatenated or encoded primary keys
+    :type primary_keys: pd.Series
+    :returns: a tuple of the types and the ids
+    :rtype: tuple(pd.Series, pd.Series)
+    """
+    if not is_encoded(primary_keys):
+        return primary_keys.str[:1], primary_keys.str[1:]
+
+    values = compact_keys(primary_keys)
+
+    return (values // ENCODED_MINIMUM).map(chr), (values % ENCODED_MINIMUM).astype(str)
+
+
+def join_keys(types, ids, encoded):
+    """the primary keys of the type and id columns of the enhanced csvs
+
+    :param types: The category characters
+    :type types: pd.Series
+    :param ids: The ids
+    :type ids: pd.Series
+    :param encoded: Create encoded keys instead of concatenated text
+    :type encoded: bool
+    :rtype: pd.Series
+    """
+    if encoded:
+        return encode_keys(types, pd.to_numeric(ids))
+
+    return types + ids
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+local.py
+A module that runs the geocode job over partitions on this machine instead of the cluster
+"""
+
+import importlib.util
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .profiling import profiled
+
+GEOCODE_JOB = Path(__file__).parent.parent / 'docker-geocode-job' / 'geocode.py'
+RESULT_PREFIX = 'local'
+
+
+def load_geocode_job():
+    """loads geocode.py from the docker job folder so the cluster and local runs share the same logic
+    """
+    spec = importlib.util.spec_from_file_location('geocode', GEOCODE_JOB)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def result_path(partition, output_folder):
+    """the result name mimics the unique prefix the cluster adds so the results can be renamed the same way
+    """
+    return Path(output_folder) / f'{RESULT_PREFIX}-{Path(partition).name}'
+
+
+@profiled(item=lambda partition, *_, **__: partition)
+def geocode_partition(partition, output_folder, api_url, ignore_failure=False):
+    """geocodes a single partition with the execute_job logic from geocode.py
+
+    :param partition: The path to the partition csv
+    :type partition: Path
+    :param output_folder: The folder to write the result to
+    :type output_folder: Path
+    :param api_url: The base url of the web api
+    :type api_url: str
+    :param ignore_failure: Ignore the continuous failure threshold
+    :type ignore_failure: bool
+    :returns: the path to the result or None when the job failed
+    :rtype: Path
+    """
+    logging.basicConfig(level=logging.INFO, format=f'{Path(partition).name}: %(message)s')
+
+    job = load_geocode_job()
+    result = result_path(partition, output_folder)
+
+    options = {
+        '--street-field': 'address',
+        '--zone-field': 'zone',
+        '--id-field': 'id',
+        '--testing': 'false',
+        '--ignore-failure': str(ignore_failure).lower(),
+        '--api-url': api_url,
+    }
+
+    #: the testing publisher writes the heartbeats to the heartbeats folder of the local output folder
+    heartbeat = job.heartbeat_publisher(str(output_folder), Path(partition).stem, 'true')
+
+    if job.execute_job(str(partition), options, str(result), heartbeat) is None:
+        return None
+
+    return result
+
+
+def geocode_local(input_folder, output_folder, api_url, workers=1, specific_file=None, ignore_failure=False):
+    """geocodes the partitions in a folder with a pool of processes and writes the results in the format
+    post-mortem expects
+
+    :param input_folder: The folder containing the partition csvs
+    :type input_folder: Path
+    :param output_folder: The folder to write the results to
+    :type output_folder: Path
+    :param api_url: The base url of the web api
+    :type api_url: str
+    :param workers: The number of partitions to geocode at once
+    :type workers: int
+    :param specific_file: The name of a single file to geocode
+    :type specific_file: str
+    :param ignore_failure: Ignore the continuous failure threshold
+    :type ignore_failure: bool
+    :returns: the paths to the results
+    :rtype: list[Path]
+    """
+    partitions = sorted(Path(input_folder).glob('*.csv'))
+
+    if specific_file is not None:
+        partitions = [item for item in partitions if item.name.casefold() == specific_file.casefold()]
+
+    return geocode_partitions(partitions, output_folder, api_url, workers, ignore_failure)
+
+
+def geocode_partitions(partitions, output_folder, api_url, workers=1, ignore_failure=False):
+    """geocodes the partitions with a pool of processes
+
+    :param partitions: The paths to the partition csvs
+    :type partitions: list[Path]
+    :param output_folder: The folder to write the results to
+    :type output_folder: Path
+    :param api_url: The base url of the web api
+    :type api_url: str
+    :param workers: The number of partitions to geocode at once
+    :type workers: int
+    :param ignore_failure: Ignore the continuous failure threshold
+    :type ignore_failure: bool
+    :returns: the paths to the results
+    :rtype: list[Path]
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    print(f'geocoding {len(partitions)} files against {api_url} with {workers} workers')
+
+    count = len(partitions)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                geocode_partition, partitions, [output_folder] * count, [api_url] * count, [ignore_failure] * count
+            )
+        )
+
+    for partition, result in zip(partitions, results):
+        if result is None:
+            print(f'{partition.name} passed the continuous fail threshold and was stopped')
+        else:
+            print(f'{partition.name} geocoded to {result}')
+
+    return [result for result in results if result is not None]
@@ -6,21 +6,156 @@ A module that sorts out why some geocodes failed
 """
 
 import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from shutil import copyfileobj, rmtree
+from tempfile import mkdtemp
 
 import pandas as pd
 
 from sweeper.address_parser import Address
 
+from .keys import compact_keys
+from .profiling import peak_rss, profiled
 
-def process_file(input_data, output_folder, separator):
-    """This takes csvs in an input_data folder and groups them by error types.
+
+NOT_FOUND = 'No address candidates found with a score of 70 or better.'
+INCOMPLETE = 'Expecting value'
+CSV_OPTIONS = {'encoding': 'utf-8', 'index': False, 'quoting': csv.QUOTE_MINIMAL, 'escapechar': '\\'}
+KEY_INDEX = '.rebase_index.pkl'
+NORMALIZE_CHUNK_SIZE = 5000
+OUTPUTS = ['all_errors.csv', 'not_found.csv', 'api_errors.csv', 'incomplete_errors.csv', 'all_errors_job.csv']
+#: the memory pandas uses while parsing a chunk compared to the parsed frame
+PARSE_OVERHEAD = 3
+SAMPLE_ROWS = 1000
+
+
+def classify_messages(messages):
+    """classifies each distinct error message once and maps the classes back to every row
+
+    - `unmatchable`: the message contains the api not found response
+    - `incomplete`: any other message that contains a json parsing error
+    - `api_errors`: every other message
+
+    :param messages: The error messages of the unmatched rows
+    :type messages: pd.Series
+    :returns: boolean masks for the unmatchable, api_errors and incomplete rows
+    :rtype: tuple(pd.Series, pd.Series, pd.Series)
+    """
+    messages = messages.astype('category')
+    categories = messages.cat.categories.astype(str)
+
+    not_found = categories.str.contains(NOT_FOUND, regex=False)
+    other = categories != NOT_FOUND
+    incomplete = other & categories.str.contains(INCOMPLETE, regex=False)
+    api_errors = other & ~incomplete
+
+    codes = messages.cat.codes.to_numpy()
+
+    def to_mask(flags):
+        return pd.Series(flags[codes], index=messages.index)
+
+    return to_mask(not_found), to_mask(api_errors), to_mask(incomplete)
+
+
+def budget_chunk_size(input_csv, separator, memory_budget):
+    """the number of rows to read at a time to parse a csv within a memory budget
+
+    :param input_csv: The csv to read
+    :type input_csv: Path
+    :param separator: The csv field separator
+    :type separator: str
+    :param memory_budget: The megabytes a chunk may use
+    :type memory_budget: float
+    :rtype: int
+    """
+    sample = pd.read_csv(
+        input_csv, encoding='utf-8', sep=separator, index_col=False, quoting=csv.QUOTE_MINIMAL, nrows=SAMPLE_ROWS
+    )
+
+    if sample.empty:
+        return SAMPLE_ROWS
+
+    row_bytes = sample.memory_usage(index=False, deep=True).sum() / len(sample.index)
+
+    return max(int(memory_budget * 1024 * 1024 / (row_bytes * PARSE_OVERHEAD)), 1)
+
+
+def infer_dtypes(input_csv, separator, chunk_size, categories=('message',)):
+    """finds the dtypes pandas would infer reading the whole csv by combining the dtypes of each chunk so a
+    chunked read writes the same values as a single read
+
+    :param input_csv: The csv to read
+    :type input_csv: Path
+    :param separator: The csv field separator
+    :type separator: str
+    :param chunk_size: The number of rows to read at a time
+    :type chunk_size: int
+    :param categories: The columns to read as categoricals
+    :type categories: tuple(str)
+    :rtype: dict
+    """
+    kinds = {}
+
+    for chunk in pd.read_csv(
+        input_csv, encoding='utf-8', sep=separator, index_col=False, quoting=csv.QUOTE_MINIMAL, chunksize=chunk_size
+    ):
+        for column, dtype in chunk.dtypes.items():
+            kinds.setdefault(column, set()).add(dtype.kind)
+
+    dtypes = {}
+    for column, found in kinds.items():
+        if column in categories:
+            dtypes[column] = 'category'
+        elif found == {'i'}:
+            dtypes[column] = 'int64'
+        elif found <= {'i', 'f'}:
+            dtypes[column] = 'float64'
+        elif found == {'b'}:
+            dtypes[column] = 'bool'
+        else:
+            dtypes[column] = str
+
+    return dtypes
+
+
+def _read_results(input_csv, separator, memory_budget=None):
+    """yields the result csv as a single frame or in chunks that fit the memory budget
+    """
+    if memory_budget is None:
+        yield pd.DataFrame(
+            pd.read_csv(input_csv, encoding='utf-8', sep=separator, index_col=False, quoting=csv.QUOTE_MINIMAL)
+        )
+
+        return
+
+    chunk_size = budget_chunk_size(input_csv, separator, memory_budget)
+
+    yield from pd.read_csv(
+        input_csv,
+        encoding='utf-8',
+        sep=separator,
+        index_col=False,
+        quoting=csv.QUOTE_MINIMAL,
+        dtype=infer_dtypes(input_csv, separator, chunk_size),
+        chunksize=chunk_size
+    )
+
+
+@profiled(item=lambda input_data, *_, **__: input_data[1], rows=lambda result: result['rows'])
+def process_file(input_data, output_folder, separator, memory_budget=None):
+    """This takes a csv from an input_data folder and groups it by error types in a single pass.
 
     - `total`: all of the unmatched addresses from the geocoded results
     - `api_errors`: a subset of total where the message is not a normal api response
     - `incomplete`: typically errors that have null parts.
        This should be inspected because other errors can get mixed in here
     - `unmatchable`: all the addresses that 404'd as not found by the api
+
+    The job file is written from the same rows as `all_errors.csv` in the format the cluster expects.
+    With a memory_budget in megabytes the csv is streamed in chunks with a categorical message.
     """
     index, input_data = input_data
 
@@ -30,76 +165,34 @@ def process_file(input_data, output_folder, separator):
 
     print(f'processing {input_data}')
 
-    data = pd.DataFrame(
-        pd.read_csv(input_data, encoding='utf-8', sep=separator, index_col=False, quoting=csv.QUOTE_MINIMAL)
-    )
-
-    data = data.loc[~(data.message.isnull()), :]
-    total = len(data.index)
     output = Path(output_folder)
-    output.mkdir(exist_ok=True)
+    output.mkdir(parents=True, exist_ok=True)
+    counts = {'rows': 0, 'total': 0, 'unmatchable': 0, 'api_errors': 0, 'incomplete': 0}
 
-    data.to_csv(
-        output / 'all_errors.csv',
-        mode='a',
-        encoding='utf-8',
-        header=header,
-        index=False,
-        sep=',',
-        quoting=csv.QUOTE_MINIMAL,
-        escapechar="\\"
-    )
+    for data in _read_results(input_data, separator, memory_budget):
+        counts['rows'] += len(data.index)
+        data = data.loc[~(data.message.isnull()), :]
+        counts['total'] += len(data.index)
 
-    unmatched = data[
-        data['message'].str.contains('No address candidates found with a score of 70 or better.', na=False)]
+        unmatched, api_issues, incomplete = classify_messages(data.message)
 
-    unmatched.to_csv(
-        output / 'not_found.csv',
-        mode='a',
-        encoding='utf-8',
-        header=header,
-        index=False,
-        sep=',',
-        quoting=csv.QUOTE_MINIMAL,
-        escapechar="\\"
-    )
+        data.to_csv(output / 'all_errors.csv', mode='a', header=header, sep=',', **CSV_OPTIONS)
+        data[unmatched].to_csv(output / 'not_found.csv', mode='a', header=header, sep=',', **CSV_OPTIONS)
+        data[api_issues].to_csv(output / 'api_errors.csv', mode='a', header=header, sep=',', **CSV_OPTIONS)
+        data[incomplete].to_csv(output / 'incomplete_errors.csv', mode='a', header=header, sep=',', **CSV_OPTIONS)
 
-    data = data.query(
-        'not message == "No address candidates found with a score of 70 or better." and not message.isnull()',
-        engine='python'
-    )
-    api_issues = data[~data['message'].str.contains('Expecting value', na=False)]
+        job = data.drop(['score', 'x', 'y', 'message'], axis=1)
+        job.rename(columns={'primary_key': 'id', 'input_address': 'address', 'input_zone': 'zone'}, inplace=True)
+        job.to_csv(output / 'all_errors_job.csv', mode='a', header=header, sep='|', **CSV_OPTIONS)
 
-    api_issues.to_csv(
-        output / 'api_errors.csv',
-        mode='a',
-        encoding='utf-8',
-        header=header,
-        index=False,
-        sep=',',
-        quoting=csv.QUOTE_MINIMAL,
-        escapechar="\\"
-    )
+        counts['unmatchable'] += int(unmatched.sum())
+        counts['api_errors'] += int(api_issues.sum())
+        counts['incomplete'] += int(incomplete.sum())
 
-    incomplete = data[data['message'].str.contains('Expecting value', na=False)]
+        #: only the first chunk of the first file writes the header
+        header = False
 
-    incomplete.to_csv(
-        output / 'incomplete_errors.csv',
-        mode='a',
-        encoding='utf-8',
-        header=header,
-        index=False,
-        sep=',',
-        quoting=csv.QUOTE_MINIMAL,
-        escapechar="\\"
-    )
-
-    return {
-        'total': total,
-        'unmatchable': len(unmatched.index),
-        'api_errors': len(api_issues.index),
-        'incomplete': len(incomplete.index),
-    }
+    return counts
 
 
 def _sum_key(dictionary, key):
@@ -111,40 +204,77 @@ def _sum_key(dictionary, key):
     return result
 
 
-def mortem(input_data, output_folder, separator):
+def _process_part(item, parts_folder, separator, memory_budget=None):
+    index, _ = item
+
+    return process_file(item, Path(parts_folder) / str(index), separator, memory_budget)
+
+
+def _concatenate_parts(parts_folder, output_folder, count):
+    """appends the per file outputs in file order to create the post mortem files
+    """
+    for name in OUTPUTS:
+        with open(Path(output_folder) / name, 'wb') as destination:
+            for index in range(count):
+                part = Path(parts_folder) / str(index) / name
+
+                if not part.exists():
+                    continue
+
+                with open(part, 'rb') as source:
+                    copyfileobj(source, destination)
+
+
+def report_peak_memory():
+    """prints the peak resident memory of the cli and of the largest worker process to size the machine
+    """
+    main, worker = peak_rss(), peak_rss(children=True)
+
+    if main is None:
+        return
+
+    if worker is None:
+        print(f'peak memory: {main / 1024 / 1024:.1f} MB')
+
+        return
+
+    print(f'peak memory: {main / 1024 / 1024:.1f} MB, largest worker: {worker / 1024 / 1024:.1f} MB')
+
+
+def mortem(input_data, output_folder, separator, workers=1, memory_budget=None):
     """This takes csvs in an input_data folder and groups them by error types writing the results to csv.
+    Each file is classified in a single pass by a pool of processes and the results are appended in file order.
 
     - `all_errors.csv`: all of the unmatched addresses from the geocoded results
     - `api_errors.csv`: a subset of `all_errors.csv` where the message is not a normal api response
     - `all_errors_job.csv`: all of the unmatched addresses from the geocoded results but in a format that can be processed by the cluster.
     - `incomplete_errors.csv`: typically errors that have null parts. This should be inspected because other errors can get mixed in here
     - `not_found.csv`: all the addresses that 404'd as not found by the api. `post-mortem normalize` will run these addresses through sweeper
+
+    With a memory_budget in megabytes the files are streamed in chunks sized so all of the workers stay within it.
+    Each file is read twice, once to find the dtypes a single read would infer and once to classify it.
     """
     files = sorted(Path(input_data).glob('*.csv'))
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
 
     print('removing any old post mortem files')
-    _ = [item.unlink() for item in Path(output_folder).glob('*.csv')]
+    _ = [item.unlink() for item in output_folder.glob('*.csv')]
 
-    results = [process_file(item, output_folder, separator) for item in enumerate(files)]
-
-    fix_me = list(Path(output_folder).glob('all_errors.csv'))[0]
-    all_errors = pd.DataFrame(
-        pd.read_csv(fix_me, encoding='utf-8', sep=separator, index_col=False, quoting=csv.QUOTE_MINIMAL)
-    )
-    all_errors.rename(columns={'primary_key': 'id', 'input_address': 'address', 'input_zone': 'zone'}, inplace=True)
+    parts_folder = Path(mkdtemp(prefix='.parts-', dir=output_folder))
 
-    all_errors.drop(['score', 'x', 'y', 'message'], axis=1, inplace=True)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    _process_part, enumerate(files), repeat(parts_folder, len(files)), repeat(separator, len(files)),
+                    repeat(_worker_budget(memory_budget, workers), len(files))
+                )
+            )
 
-    all_errors.to_csv(
-        Path(output_folder) / 'all_errors_job.csv',
-        mode='a',
-        encoding='utf-8',
-        header=True,
-        index=False,
-        sep='|',
-        quoting=csv.QUOTE_MINIMAL,
-        escapechar="\\"
-    )
+        _concatenate_parts(parts_folder, output_folder, len(files))
+    finally:
+        rmtree(parts_folder)
 
     print(f'\ntotal unmatched records: {_sum_key(results, "total")}')
     print('unmatched address breakdown')
@@ -152,71 +282,286 @@ def mortem(input_data, output_folder, separator):
     print(f'  api errors: {_sum_key(results, "api_errors")}')
     print(f'  address not found (bad address or formatting): {_sum_key(results, "unmatchable")}')
 
+    if memory_budget is not None:
+        report_peak_memory()
+
+
+def _worker_budget(memory_budget, workers):
+    if memory_budget is None:
+        return None
+
+    return memory_budget / max(workers, 1)
+
+
+def load_key_index(input_data, files, separator=',', workers=1):
+    """Creates a primary_key to file index for the result csvs. The keys of each file are stored in a sidecar
+    next to the results and are only read again when the file size or modified time changes.
 
-def rebase(input_data, specific_file, separator, message):
+    :param input_data: The folder containing the result csvs
+    :type input_data: Path
+    :param files: The result csvs to index
+    :type files: list[Path]
+    :param separator: The csv field separator
+    :type separator: str
+    :param workers: The number of files to scan in parallel
+    :type workers: int
+    :returns: a frame of every primary_key and the name of the file containing it
+    :rtype: pd.DataFrame
+    """
+    index_file = Path(input_data) / KEY_INDEX
+    cached = {}
+
+    if index_file.exists():
+        cached = pd.read_pickle(index_file)
+
+    index = {}
+    stale = []
+
+    for result in files:
+        entry = cached.get(result.name)
+
+        #: entries without the compact flag hold text keys from before integer keys were compacted
+        if entry is not None and entry['stat'] == _file_stat(result) and entry.get('compact'):
+            index[result.name] = entry
+        else:
+            stale.append(result)
+
+    if stale:
+        print(f'scanning {len(stale)} files for primary keys')
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result, keys in zip(stale, executor.map(_read_keys, stale, repeat(separator, len(stale)))):
+                index[result.name] = {'stat': _file_stat(result), 'keys': keys, 'compact': True}
+
+        pd.to_pickle(index, index_file)
+
+    if not index:
+        return pd.DataFrame(columns=['primary_key', 'file'])
+
+    return pd.concat(
+        [pd.DataFrame({
+            'primary_key': entry['keys'],
+            'file': name
+        }) for name, entry in index.items()],
+        ignore_index=True
+    )
+
+
+def _file_stat(path):
+    stat = path.stat()
+
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _read_keys(result, separator):
+    keys = pd.read_csv(
+        result, usecols=['primary_key'], dtype=str, encoding='utf-8', sep=separator, quoting=csv.QUOTE_MINIMAL
+    ).primary_key
+
+    return compact_keys(keys).to_numpy()
+
+
+@profiled(item=lambda result, *_, **__: result, rows=lambda changed: changed)
+def _rebase_file(result, new_data, separator, memory_budget=None):
+    """updates a single result csv and atomically replaces it. With a memory_budget in megabytes the csv is
+    streamed through the update in chunks
+    """
+    print(f'rebasing {len(new_data.index)} records into {result.name}')
+
+    chunk_size = None
+    if memory_budget is not None:
+        chunk_size = budget_chunk_size(result, separator, memory_budget)
+
+    chunks = pd.read_csv(
+        result,
+        index_col='primary_key',
+        dtype=str,
+        encoding='utf-8',
+        sep=separator,
+        quoting=csv.QUOTE_MINIMAL,
+        chunksize=chunk_size
+    )
+
+    if chunk_size is None:
+        chunks = [pd.DataFrame(chunks)]
+
+    temp = result.with_suffix('.csv.tmp')
+    changed = 0
+    header = True
+
+    with open(temp, 'w', encoding='utf-8', newline='') as output:
+        for data in chunks:
+            if pd.api.types.is_integer_dtype(new_data.index):
+                data.index = data.index.astype('int64')
+
+            data.update(new_data)
+            data.to_csv(output, header=header, sep=separator, quoting=csv.QUOTE_MINIMAL)
+
+            changed += int(data.index.isin(new_data.index).sum())
+            header = False
+
+    temp.replace(result)
+
+    return changed
+
+
+def _read_retry(retry_csv, separator, memory_budget=None):
+    """reads the rows of a retry result that found a match. Only the matched rows are kept when the csv is
+    streamed in chunks, but every matched row is held in memory so the budget does not bound them
+    """
+    chunk_size = None
+    if memory_budget is not None:
+        chunk_size = budget_chunk_size(retry_csv, separator, memory_budget)
+
+    chunks = pd.read_csv(
+        retry_csv,
+        index_col='primary_key',
+        dtype=str,
+        encoding='utf-8',
+        sep=separator,
+        quoting=csv.QUOTE_MINIMAL,
+        chunksize=chunk_size
+    )
+
+    if chunk_size is None:
+        chunks = [pd.DataFrame(chunks)]
+
+    #: remove 0 score records
+    return pd.concat([chunk.loc[~(chunk.score == "0")] for chunk in chunks])
+
+
+def rebase(input_data, specific_file, separator, message, workers=1, memory_budget=None):
     """This method updates the csv files in the input_data folder with any new geocodes
     found in the specific_file. It also updates the message from the old error to a new
-    value so it can be differentiated from the others."""
+    value so it can be differentiated from the others. Only the files containing a rebased
+    primary key are rewritten. With a memory_budget in megabytes the retry and result files
+    are streamed in chunks. Only the result files stay within the budget since the matched
+    retry rows are held in memory to update them."""
     files = list(Path(input_data).glob('*.csv'))
     all_errors = [item for item in files if item.match(specific_file)][0]
     files.remove(all_errors)
 
-    new_data = pd.DataFrame(
-        pd.read_csv(
-            all_errors, index_col='primary_key', dtype=str, encoding='utf-8', sep=separator, quoting=csv.QUOTE_MINIMAL
-        )
-    )
+    new_data = _read_retry(all_errors, separator, memory_budget)
 
-    new_data = new_data.loc[~(new_data.score == "0")]  #: remove 0 score records
+    #: integer encoded keys are indexed and matched as int64 instead of text
+    new_data.index = pd.Index(compact_keys(new_data.index.to_series()), name='primary_key')
 
     print(f'found {len(new_data.index)} records to rebase')
 
     new_data.message = message
 
-    for result in files:
-        data = pd.DataFrame(
-            pd.read_csv(
-                result, index_col='primary_key', dtype=str, encoding='utf-8', sep=separator, quoting=csv.QUOTE_MINIMAL
+    if memory_budget is not None:
+        #: the same message is repeated on every row
+        new_data.message = new_data.message.astype('category')
+
+    key_index = load_key_index(input_data, files, separator, workers)
+    key_index = key_index.loc[key_index.primary_key.isin(new_data.index)]
+
+    affected = [(Path(input_data) / name, new_data.loc[new_data.index.isin(keys.primary_key)])
+                for name, keys in key_index.groupby('file', sort=True)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        changed = list(
+            executor.map(
+                _rebase_file, [result for result, _ in affected], [updates for _, updates in affected],
+                repeat(separator, len(affected)), repeat(_worker_budget(memory_budget, workers), len(affected))
             )
         )
-        data.update(new_data)
-        data.to_csv(result, encoding='utf-8', sep=separator, quoting=csv.QUOTE_MINIMAL)
 
+    if affected:
+        #: the rewritten files have a new modified time but the same keys
+        index_file = Path(input_data) / KEY_INDEX
+        index = pd.read_pickle(index_file)
 
-def try_standardize_unmatched(input_csv, output_file):
-    """This method takes an input, parses it with sweeper and
-    tries to standardize the address for another geocode run"""
-    total = 0
-    invalid = 0
+        for result, _ in affected:
+            index[result.name]['stat'] = _file_stat(result)
 
-    def normalize(street):
-        try:
-            address = Address(street)
+        pd.to_pickle(index, index_file)
 
-            if address.po_box:
-                return None
+    print(f'\nrebased {sum(changed)} rows in {len(affected)} of {len(files)} files')
 
-            parts = [
-                address.address_number, address.address_number_suffix, address.prefix_direction, address.street_name,
-                address.street_type, address.street_direction
-            ]
+    if memory_budget is not None:
+        report_peak_memory()
 
-            normalized = ' '.join([part for part in parts if part is not None])
 
-            if normalized == street:
-                return None
+def normalize_address(street):
+    """parses a street with sweeper and returns the standardized street or None when it
+    could not be parsed, is a po box or did not change"""
+    try:
+        address = Address(street)
 
-            return normalized
-        except Exception:
+        if address.po_box:
             return None
 
+        parts = [
+            address.address_number, address.address_number_suffix, address.prefix_direction, address.street_name,
+            address.street_type, address.street_direction
+        ]
+
+        normalized = ' '.join([part for part in parts if part is not None])
+
+        if normalized == street:
+            return None
+
+        return normalized
+    except Exception:
+        return None
+
+
+def _normalize_chunk(streets):
+    return [normalize_address(street) for street in streets]
+
+
+def normalize_addresses(streets, workers=1, cache_file=None, chunk_size=NORMALIZE_CHUNK_SIZE):
+    """normalizes each distinct street once, spreading the streets that are not already cached over a pool
+    of processes
+
+    :param streets: The streets to normalize
+    :type streets: pd.Series
+    :param workers: The number of processes to parse with
+    :type workers: int
+    :param cache_file: An optional json file to read and store the parsed streets between runs
+    :type cache_file: Path
+    :param chunk_size: The number of streets to send to a process at a time
+    :type chunk_size: int
+    :returns: the normalized street for each input street
+    :rtype: pd.Series
+    """
+    cache = {}
+
+    if cache_file is not None and Path(cache_file).exists():
+        cache = json.loads(Path(cache_file).read_text(encoding='utf-8'))
+
+    unique = [street for street in streets.dropna().unique() if street not in cache]
+
+    print(f'parsing {len(unique)} distinct addresses of {len(streets.index)} ({len(cache)} cached)')
+
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk, normalized in zip(chunks, executor.map(_normalize_chunk, chunks)):
+            cache.update(zip(chunk, normalized))
+
+    if cache_file is not None:
+        Path(cache_file).write_text(json.dumps(cache), encoding='utf-8')
+
+    return streets.map(cache)
+
+
+@profiled(item=lambda input_csv, *_, **__: input_csv)
+def try_standardize_unmatched(input_csv, output_file, workers=1, cache_file=None):
+    """This method takes an input, parses it with sweeper and
+    tries to standardize the address for another geocode run"""
+    total = 0
+    invalid = 0
+
     print('reading unmatched records')
     data = pd.DataFrame(pd.read_csv(input_csv, encoding='utf-8', index_col=False, quoting=csv.QUOTE_MINIMAL))
     total = len(data.index)
 
     print('normalizing address data')
     data['input_address'] = data['input_address'].str.replace(' +', ' ', regex=False)
-    data['address'] = data.apply(lambda row: normalize(row['input_address']), axis=1)
+    data['address'] = normalize_addresses(data['input_address'], workers, cache_file)
 
     invalid = data['primary_key'].count()
     data.dropna(inplace=True)
@@ -242,7 +587,7 @@ def try_standardize_unmatched(input_csv, output_file):
     print('writing normalized addresses')
     data.to_csv(output_file, index=False, sep='|', header=True, quoting=csv.QUOTE_MINIMAL, escapechar="\\")
 
-    print(f'\nread {total + len(extra.index)} rows')
-    print(f'invalid addresses {(100 * invalid / total):%.2f%}%')
+    print(f'\nread {total} rows')
+    print(f'invalid addresses {(100 * invalid / total):.2f}%')
     print(f'{invalid} addresses could not be parsed')
     print(f'saving {data["id"].count()} items for retry')
@@ -11,10 +11,22 @@ from shutil import rmtree
 
 import pandas as pd
 
+from .keys import encode_keys
+from .profiling import profiled
 
-def create_partitions(input_data, output_data, chunk_size, separator, column_names):
+
+@profiled(item=lambda input_data, *_, **__: input_data, rows=lambda total: total)
+def create_partitions(
+    input_data, output_data, chunk_size, separator, column_names, on_partition=None, integer_keys=False
+):
     """partitions a single file into multiple based on chunks
+
+    :param on_partition: An optional function called with the path of each partition as soon as it is written
+    :param integer_keys: Encode the category and partial-id into a single integer id instead of concatenating them
+    :returns: the number of rows partitioned
     """
+    total = 0
+
     for i, partition in enumerate(
         pd.read_csv(
             input_data,
@@ -40,7 +52,10 @@ def create_partitions(input_data, output_data, chunk_size, separator, column_nam
         partitioned_csv = partitioned_csv.joinpath(f'partition_{i}.csv')
         partitioned_csv.touch(exist_ok=False)
 
-        partition = partition.assign(id=partition.category + partition['partial-id'].map(str))
+        if integer_keys:
+            partition = partition.assign(id=encode_keys(partition.category, partition['partial-id']))
+        else:
+            partition = partition.assign(id=partition.category + partition['partial-id'].map(str))
         columns = ['id', 'address', 'zone']
         partition = partition.reindex(columns, axis=1)
 
@@ -52,3 +67,29 @@ def create_partitions(input_data, output_data, chunk_size, separator, column_nam
 
         with open(partitioned_csv, 'w', encoding='utf-8') as output_file:
             partition.to_csv(output_file, header=True, index=False, sep='|', quoting=csv.QUOTE_NONE, escapechar="\\")
+
+        total += len(partition.index)
+
+        if on_partition is not None:
+            on_partition(partitioned_csv)
+
+    return total
+
+
+def result_name(partition):
+    """the name a geocoded partition result is given by rename_results
+    """
+    return f'{chr(ord("a") + int(Path(partition).stem.split("_")[1]))}.csv'
+
+
+def rename_results(csv_folder):
+    """renames the geocoded partition results to be compatible with a file geodatabase
+    """
+    rename_files = Path(csv_folder).glob('*-partition_*.csv')
+
+    for path in rename_files:
+        new_name = result_name(path)
+        print(f'renaming {path.stem} to {new_name}')
+
+        #: replace the result of an earlier run instead of failing when it exists
+        path.replace(path.parent / new_name)
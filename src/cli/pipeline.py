@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+pipeline.py
+A module that runs the geocoding stages end to end and skips the stages and files whose inputs did not change
+"""
+
+import json
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from pathlib import Path
+from time import monotonic, sleep
+
+from .enhance import enhance, merge
+from .jobs import RESULTS_BUCKET, UPLOAD_BUCKET, create_jobs
+from .local import geocode_partitions
+from .mortem import mortem
+from .partition import create_partitions, rename_results, result_name
+from .upload import storage_client, upload_files
+
+MANIFEST = 'pipeline.json'
+STAGES = ['partitions', 'upload', 'jobs', 'geocode', 'rename', 'post-mortem', 'enhance', 'merge']
+HASH_BLOCK_SIZE = 1024 * 1024
+POLL_SECONDS = 30
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def load_manifest(path):
+    """loads the content hashes of the inputs and outputs of each stage recorded by the last run
+
+    :param path: The path to the manifest json file
+    :type path: Path
+    :rtype: dict
+    """
+    manifest = {'path': str(path), 'files': {}, 'stages': {}, 'uploads': {}, 'geocoded': {}}
+
+    if Path(path).exists():
+        manifest.update(json.loads(Path(path).read_text(encoding='utf-8')))
+
+    return manifest
+
+
+def save_manifest(manifest):
+    """writes the manifest so a failed run resumes from the last completed stage
+    """
+    path = Path(manifest['path'])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix('.tmp')
+    temp.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    temp.replace(path)
+
+
+def hash_file(manifest, path):
+    """the content hash of a file. hashes are cached by size and modified time so unchanged files are not read again
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    cached = manifest['files'].get(str(path))
+
+    if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached[2]
+
+    digest = blake2b(digest_size=16)
+
+    with open(path, 'rb') as data:
+        for block in iter(lambda: data.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    manifest['files'][str(path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+    return digest.hexdigest()
+
+
+def hash_files(manifest, paths):
+    """the content hashes of the files keyed by name
+    """
+    return {Path(path).name: hash_file(manifest, path) for path in sorted(paths)}
+
+
+def run_stage(manifest, name, inputs, outputs, action):
+    """runs the action unless the inputs and outputs match the hashes recorded by the last run
+
+    :param manifest: The manifest from load_manifest
+    :type manifest: dict
+    :param name: The name of the stage
+    :type name: str
+    :param inputs: The input files of the stage
+    :type inputs: list[Path]
+    :param outputs: A function returning the output files of the stage
+    :type outputs: function
+    :param action: The function that runs the stage
+    :type action: function
+    :returns: True if the stage ran
+    :rtype: bool
+    """
+    input_hashes = hash_files(manifest, inputs)
+    record = manifest['stages'].get(name)
+
+    if record is not None and record['inputs'] == input_hashes and record['outputs'] == hash_files(manifest, outputs()):
+        print(f'{name}: inputs unchanged. skipping')
+
+        return False
+
+    print(f'{name}: running')
+    action()
+
+    manifest['stages'][name] = {'inputs': input_hashes, 'outputs': hash_files(manifest, outputs())}
+    save_manifest(manifest)
+
+    return True
+
+
+def _run(command):
+    print(' '.join(command))
+    subprocess.run(command, check=True)
+
+
+def _seconds(duration):
+    """converts a kubectl style duration like 24h, 90m or 30s to seconds
+    """
+    duration = str(duration)
+
+    if duration[-1] in DURATION_UNITS:
+        return float(duration[:-1]) * DURATION_UNITS[duration[-1]]
+
+    return float(duration)
+
+
+def job_state(job):
+    """the Complete or Failed condition of a job or None while it is still running
+
+    :param job: The path to the job yml
+    :type job: str
+    :rtype: str
+    """
+    conditions = subprocess.run(
+        ['kubectl', 'get', '-f', job, '-o', 'jsonpath={.status.conditions[?(@.status=="True")].type}'],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout.split()
+
+    for state in ('Failed', 'Complete'):
+        if state in conditions:
+            return state
+
+    return None
+
+
+def wait_for_jobs(jobs, timeout):
+    """polls the jobs until each of them completed or failed. kubectl wait only returns for a single condition so a
+    job that exhausted its backoffLimit would be waited on until the timeout
+
+    :param jobs: The paths to the job ymls
+    :type jobs: list[str]
+    :param timeout: How long to wait for the jobs as a kubectl style duration
+    :type timeout: str
+    :returns: the Complete or Failed state of each job or None for the jobs still running at the timeout
+    :rtype: dict
+    """
+    states = dict.fromkeys(jobs)
+    deadline = monotonic() + _seconds(timeout)
+
+    while True:
+        for job in [job for job, state in states.items() if state is None]:
+            states[job] = job_state(job)
+
+        if all(states.values()) or monotonic() >= deadline:
+            return states
+
+        sleep(POLL_SECONDS)
+
+
+def run_kubernetes(partitions, options):
+    """replaces the job of each partition on the cluster, waits for those jobs to complete or fail and downloads the
+    newest result of each partition that completed
+
+    :returns: the partitions whose job failed or did not finish
+    :rtype: list[Path]
+    """
+    jobs = {partition: str(Path(options['jobs']) / f'job_{partition.stem}.yml') for partition in partitions}
+
+    for job in jobs.values():
+        #: applying a job with the name of a completed job does not run it again
+        _run(['kubectl', 'delete', '--ignore-not-found', '-f', job])
+        _run(['kubectl', 'apply', '-f', job])
+
+    states = wait_for_jobs(list(jobs.values()), options['timeout'])
+    failed = [partition for partition, job in jobs.items() if states[job] != 'Complete']
+
+    for partition in failed:
+        reason = 'failed' if states[jobs[partition]] else f'did not finish within {options["timeout"]}'
+        print(f'{partition.name}: the job {reason}')
+
+    download_results([partition for partition in partitions if partition not in failed], options['results'])
+
+    return failed
+
+
+def download_results(partitions, results_folder):
+    """downloads the newest result of each partition from the results bucket. The jobs prefix each result with a
+    unique id so the results of earlier runs are still in the bucket
+
+    :param partitions: The partitions that were geocoded
+    :type partitions: list[Path]
+    :param results_folder: The folder to download the results to
+    :type results_folder: Path
+    """
+    results_folder = Path(results_folder)
+    results_folder.mkdir(parents=True, exist_ok=True)
+
+    blobs = [blob for blob in storage_client().list_blobs(RESULTS_BUCKET) if '/' not in blob.name]
+
+    for partition in partitions:
+        candidates = [blob for blob in blobs if blob.name.endswith(f'-{partition.name}')]
+
+        if not candidates:
+            print(f'no result was found for {partition.name} in {RESULTS_BUCKET}')
+
+            continue
+
+        newest = max(candidates, key=lambda blob: blob.updated)
+
+        #: results of an earlier run that were not renamed yet would be renamed over the new result
+        for stale in results_folder.glob(f'*-{partition.name}'):
+            stale.unlink()
+
+        print(f'downloading {newest.name}')
+        newest.download_to_filename(str(results_folder / newest.name))
+
+
+def run_command(partitions, options):
+    """a local stand-in for the cluster that runs a command for each partition. The command is formatted with the
+    `csv` path of the partition and the `output` path the result must be written to
+    """
+
+    def geocode(partition):
+        output = Path(options['results']) / f'local-{partition.name}'
+        _run(shlex.split(options['command'].format(csv=partition, output=output)))
+
+    with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+        list(executor.map(geocode, partitions))
+
+
+def run_local(partitions, options):
+    """geocodes the partitions on this machine with the same logic as the cluster jobs
+    """
+    geocode_partitions(partitions, options['results'], options['api_url'], options['workers'], ignore_failure=True)
+
+
+def _has_result(results, partition):
+    """a partition has a result if it was downloaded or already renamed
+    """
+    return (Path(results) / result_name(partition)).exists() or any(Path(results).glob(f'*-{partition.name}'))
+
+
+CLUSTERS = {'kubernetes': run_kubernetes, 'local': run_local, 'command': run_command}
+
+
+def run(
+    input_csv,
+    separator,
+    column_names,
+    chunk_size,
+    folders,
+    cluster='kubernetes',
+    options=None,
+    stop_after=None,
+    integer_keys=False
+):
+    """runs the pipeline from the input csv to the merged enhanced results
+
+    :param input_csv: The large csv file to partition
+    :type input_csv: Path
+    :param separator: The csv file field separator
+    :type separator: str
+    :param column_names: The column names in the csv
+    :type column_names: list[str]
+    :param chunk_size: The amount of records to have in each partition
+    :type chunk_size: int
+    :param folders: The `partitions`, `jobs`, `results`, `postmortem` and `final` folders
+    :type folders: dict
+    :param cluster: The name of the function in CLUSTERS that geocodes the partitions
+    :type cluster: str
+    :param options: The options for the cluster function
+    :type options: dict
+    :param stop_after: The name of the last stage to run
+    :type stop_after: str
+    :param integer_keys: Encode the category and partial-id of the partitions into integer ids
+    :type integer_keys: bool
+    """
+    folders = {key: Path(value) for key, value in folders.items()}
+    options = dict(options or {}, jobs=folders['jobs'], results=folders['results'])
+    last_stage = STAGES.index(stop_after or STAGES[-1])
+
+    manifest = load_manifest(folders['results'].parent / MANIFEST)
+
+    if manifest.get('integer_keys', False) != integer_keys:
+        #: every stage output depends on the format of the primary keys
+        manifest['stages'] = {}
+        manifest['integer_keys'] = integer_keys
+    geocode = CLUSTERS[cluster]
+    remote = geocode is run_kubernetes
+
+    def partitions():
+        return sorted(folders['partitions'].glob('partition_*.csv'), key=lambda path: int(path.stem.split('_')[1]))
+
+    with ThreadPoolExecutor(max_workers=1) as uploader:
+        uploads = {}
+
+        def upload(partition):
+            partition_hash = hash_file(manifest, partition)
+
+            if manifest['uploads'].get(partition.name) == partition_hash or partition.name in uploads:
+                return
+
+            #: the upload of a partition overlaps with writing the next one
+            uploads[partition.name] = (partition_hash, uploader.submit(upload_files, str(partition), UPLOAD_BUCKET))
+
+        def write_partitions():
+            create_partitions(
+                input_csv, folders['partitions'], chunk_size, separator, column_names,
+                upload if remote and last_stage >= STAGES.index('upload') else None, integer_keys
+            )
+
+        run_stage(manifest, 'partitions', [input_csv], partitions, write_partitions)
+
+        if last_stage < STAGES.index('upload'):
+            return
+
+        if remote:
+            #: upload any partitions that were not uploaded by a previous run
+            for partition in partitions():
+                upload(partition)
+
+            for name, (partition_hash, future) in uploads.items():
+                future.result()
+                manifest['uploads'][name] = partition_hash
+
+            save_manifest(manifest)
+
+    if last_stage < STAGES.index('jobs'):
+        return
+
+    if remote:
+        run_stage(
+            manifest, 'jobs', partitions(), lambda: folders['jobs'].glob('*.yml'),
+            lambda: create_jobs(folders['partitions'], folders['jobs'])
+        )
+
+    if last_stage < STAGES.index('geocode'):
+        return
+
+    pending = [
+        partition for partition in partitions()
+        if manifest['geocoded'].get(partition.name) != hash_file(manifest, partition) or
+        not _has_result(folders['results'], partition)
+    ]
+
+    print(f'geocode: {len(pending)} partitions changed since the last run')
+
+    failed = []
+
+    if pending:
+        failed = geocode(pending, options) or []
+
+    for partition in pending:
+        if partition not in failed:
+            manifest['geocoded'][partition.name] = hash_file(manifest, partition)
+
+    save_manifest(manifest)
+
+    if failed:
+        #: the failed partitions are not recorded as geocoded so the next run applies only their jobs again
+        raise RuntimeError(
+            f'{len(failed)} partitions were not geocoded: {", ".join(partition.name for partition in failed)}. '
+            'run the pipeline again to retry them'
+        )
+
+    if last_stage < STAGES.index('rename'):
+        return
+
+    rename_results(folders['results'])
+
+    def results():
+        return folders['results'].glob('*.csv')
+
+    if last_stage < STAGES.index('post-mortem'):
+        return
+
+    run_stage(
+        manifest, 'post-mortem', list(results()), lambda: folders['postmortem'].glob('*.csv'),
+        lambda: mortem(folders['results'], folders['postmortem'], ',', options.get('workers', 1))
+    )
+
+    if last_stage < STAGES.index('enhance'):
+        return
+
+    run_stage(
+        manifest, 'enhance', list(results()), lambda: folders['final'].glob('*_step_*.csv'),
+        lambda: enhance(folders['results'], final_folder=folders['final'])
+    )
+
+    if last_stage < STAGES.index('merge'):
+        return
+
+    run_stage(
+        manifest, 'merge', list(folders['final'].glob('*_step_*.csv')), lambda: folders['final'].glob('all.csv'),
+        lambda: merge(folders['final'], workers=options.get('workers', 1))
+    )
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+plan.py
+A module that geocodes a stratified sample of the partitions to project the duration, failures and pods of a run
+"""
+
+import csv
+import heapq
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .keys import split_keys
+from .local import geocode_partitions, result_path
+from .mortem import classify_messages
+
+READ_CHUNK_SIZE = 100000
+MIN_STRATUM_SAMPLE = 5
+OUTCOMES = ['matched', 'not_found', 'api_errors', 'incomplete']
+
+
+def _partitions(input_folder):
+    return sorted(Path(input_folder).glob('partition_*.csv'), key=lambda path: int(path.stem.split('_')[1]))
+
+
+def _read_partition(partition):
+    return pd.read_csv(
+        partition,
+        sep='|',
+        dtype=str,
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE,
+        encoding='utf-8',
+        chunksize=READ_CHUNK_SIZE
+    )
+
+
+def strata(chunk):
+    """the stratum of each row is the category and the zone. zip codes are compared by their first 5 digits
+
+    :param chunk: Partition rows with an id and zone
+    :type chunk: pd.DataFrame
+    :rtype: pd.Series
+    """
+    zone = chunk.zone.str.strip().str.upper()
+    zone = zone.where(~zone.str[:5].str.isdigit(), zone.str[:5])
+
+    return split_keys(chunk.id)[0] + '|' + zone
+
+
+def count_strata(partitions):
+    """counts the rows in each stratum and partition
+
+    :param partitions: The partition csvs from create_partitions
+    :type partitions: list[Path]
+    :returns: a tuple of the rows per stratum and the rows per partition
+    :rtype: tuple(pd.Series, dict)
+    """
+    counts = []
+    sizes = {}
+
+    for partition in partitions:
+        sizes[partition.name] = 0
+
+        for chunk in _read_partition(partition):
+            counts.append(strata(chunk).value_counts())
+            sizes[partition.name] += len(chunk.index)
+
+    return pd.concat(counts).groupby(level=0).sum(), sizes
+
+
+def sampling_rates(population, sample_size):
+    """the fraction of each stratum to sample. Strata large enough to expect a sampled row get at least
+    MIN_STRATUM_SAMPLE rows so their outcome mix can be measured and the rate of the other rows is lowered so the
+    expected sample is still sample_size. When the minimums alone are more than sample_size they are scaled down
+
+    :param population: The rows per stratum from count_strata
+    :type population: pd.Series
+    :param sample_size: The number of rows to sample
+    :type sample_size: int
+    :rtype: pd.Series
+    """
+    base = min(sample_size / population.sum(), 1)
+    floor = (MIN_STRATUM_SAMPLE / population).clip(upper=1).where(population * base >= 1, 0)
+
+    def expected(rate):
+        return (population * floor.clip(lower=rate)).sum()
+
+    if expected(0) >= sample_size:
+        return floor * sample_size / expected(0)
+
+    #: the expected sample grows with the shared rate so it is found by bisection
+    low, high = 0.0, base
+    for _ in range(50):
+        middle = (low + high) / 2
+
+        if expected(middle) < sample_size:
+            low = middle
+        else:
+            high = middle
+
+    return floor.clip(lower=high)
+
+
+def draw_sample(partitions, population, sample_size, seed=0):
+    """draws a sample with each stratum allocated in proportion to its rows with the rates from sampling_rates
+
+    :param partitions: The partition csvs from create_partitions
+    :type partitions: list[Path]
+    :param population: The rows per stratum from count_strata
+    :type population: pd.Series
+    :param sample_size: The number of rows to sample
+    :type sample_size: int
+    :param seed: The random seed
+    :type seed: int
+    :rtype: pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    rates = sampling_rates(population, sample_size)
+    samples = []
+
+    for partition in partitions:
+        for chunk in _read_partition(partition):
+            chunk['stratum'] = strata(chunk)
+            keep = rng.random(len(chunk.index)) < chunk.stratum.map(rates).to_numpy()
+
+            samples.append(chunk.loc[keep])
+
+    return pd.concat(samples, ignore_index=True)
+
+
+def outcomes(results):
+    """the outcome of each geocoded row
+
+    :param results: The geocode.py result rows
+    :type results: pd.DataFrame
+    :rtype: pd.Series
+    """
+    outcome = pd.Series('matched', index=results.index)
+    errors = results.message.notna()
+    not_found, api_errors, incomplete = classify_messages(results.message[errors])
+
+    outcome[not_found[not_found].index] = 'not_found'
+    outcome[api_errors[api_errors].index] = 'api_errors'
+    outcome[incomplete[incomplete].index] = 'incomplete'
+
+    return outcome
+
+
+def makespan(durations, pods):
+    """how long the jobs take when each pod takes the longest job that is left
+
+    :param durations: The seconds each job takes
+    :type durations: list[float]
+    :param pods: The number of jobs that run at once
+    :type pods: int
+    :rtype: float
+    """
+    finishes = [0.0] * min(pods, len(durations))
+
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(finishes, heapq.heappop(finishes) + duration)
+
+    return max(finishes, default=0)
+
+
+def pods_needed(durations, target_seconds):
+    """the fewest pods that finish the jobs within the target. None when the longest job is longer than the target
+
+    :param durations: The seconds each job takes
+    :type durations: list[float]
+    :param target_seconds: The time the run must finish in
+    :type target_seconds: float
+    :rtype: int
+    """
+    if not durations or max(durations) > target_seconds:
+        return None
+
+    low, high = 1, len(durations)
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if makespan(durations, middle) <= target_seconds:
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
+
+
+def plan(input_folder, plan_folder, api_url, sample_size=2000, workers=1, target_hours=8, seed=0):
+    """geocodes a stratified sample of the partitions and projects the duration, failures and pods of the full run
+
+    :param input_folder: The folder containing the partition csvs from create_partitions
+    :type input_folder: Path
+    :param plan_folder: The folder to write the sample, its results and plan.json to
+    :type plan_folder: Path
+    :param api_url: The base url of the web api or a mock of it
+    :type api_url: str
+    :param sample_size: The number of rows to geocode
+    :type sample_size: int
+    :param workers: The number of sample files to geocode at once
+    :type workers: int
+    :param target_hours: The time the run should finish in
+    :type target_hours: float
+    :param seed: The random seed for the sample
+    :type seed: int
+    :returns: the plan
+    :rtype: dict
+    """
+    plan_folder = Path(plan_folder)
+    partitions = _partitions(input_folder)
+
+    if not partitions:
+        print(f'no partitions found in {input_folder}')
+
+        return None
+
+    if plan_folder.exists():
+        shutil.rmtree(plan_folder)
+
+    sample_folder = plan_folder / 'sample'
+    results_folder = plan_folder / 'results'
+    sample_folder.mkdir(parents=True)
+
+    print(f'counting the strata of {len(partitions)} partitions')
+    population, sizes = count_strata(partitions)
+    total = int(population.sum())
+
+    sample = draw_sample(partitions, population, sample_size, seed)
+    print(
+        f'sampled {len(sample.index)} of {total} rows ({sample_size} requested) from {len(population.index)} zone and '
+        'category strata'
+    )
+
+    #: the sample is split so each worker runs the job client like a pod would
+    samples = []
+    for i, part in enumerate(np.array_split(sample.index, max(workers, 1))):
+        samples.append(sample_folder / f'sample_{i}.csv')
+        sample.loc[part, ['id', 'address', 'zone']].to_csv(
+            samples[-1], sep='|', index=False, quoting=csv.QUOTE_NONE, escapechar='\\', encoding='utf-8'
+        )
+
+    geocode_partitions(samples, results_folder, api_url, workers, ignore_failure=True)
+
+    results = pd.concat(
+        [pd.read_csv(result_path(item, results_folder), dtype={'primary_key': str}) for item in samples],
+        ignore_index=True
+    )
+    heartbeats = [
+        json.loads((results_folder / 'heartbeats' / f'{item.stem}.json').read_text(encoding='utf-8'))
+        for item in samples
+    ]
+
+    #: the jobs geocode one row at a time so the seconds per row of a pod is the inverse of its rate
+    sampled_rows = sum(heartbeat['rows_done'] for heartbeat in heartbeats)
+    seconds_per_row = sum(
+        heartbeat['rows_done'] / heartbeat['average_rate'] for heartbeat in heartbeats if heartbeat['average_rate']
+    ) / max(sampled_rows, 1)
+
+    results['outcome'] = outcomes(results).to_numpy()
+    results['stratum'] = results.primary_key.map(sample.set_index('id').stratum)
+
+    overall = results.outcome.value_counts(normalize=True).reindex(OUTCOMES, fill_value=0)
+    by_stratum = pd.crosstab(results.stratum, results.outcome, normalize='index').reindex(columns=OUTCOMES, fill_value=0)
+
+    #: strata that were not sampled are projected with the overall outcome mix
+    mix = by_stratum.reindex(population.index).fillna(overall)
+    projected = mix.mul(population, axis=0).sum().round().astype(int)
+
+    durations = [rows * seconds_per_row for rows in sizes.values()]
+    target_seconds = target_hours * 3600
+    pods = pods_needed(durations, target_seconds)
+    largest = max(sizes.values())
+
+    summary = {
+        'partitions': len(partitions),
+        'total_rows': total,
+        'sampled_rows': int(len(results.index)),
+        'strata': int(len(population.index)),
+        'seconds_per_row': seconds_per_row,
+        'outcome_mix': overall.round(4).to_dict(),
+        'projected_outcomes': projected.to_dict(),
+        'pod_hours': total * seconds_per_row / 3600,
+        'single_job_hours': largest * seconds_per_row / 3600,
+        'target_hours': target_hours,
+        'pods': pods,
+        'projected_hours': makespan(durations, pods or len(durations)) / 3600,
+        #: the largest partition that one pod finishes within the target
+        'max_chunk_size': int(target_seconds / seconds_per_row) if seconds_per_row else None,
+    }
+
+    (plan_folder / 'plan.json').write_text(json.dumps(summary, indent=2), encoding='utf-8')
+
+    print(f'\n{total} rows in {len(partitions)} partitions')
+    print(f'{1 / seconds_per_row if seconds_per_row else 0:.1f} rows per second per pod')
+    print('projected outcomes')
+    for outcome in OUTCOMES:
+        print(f'  {outcome}: {projected[outcome]} ({100 * overall[outcome]:.2f}%)')
+    print(f'{summary["pod_hours"]:.2f} pod hours')
+
+    if pods is None:
+        print(
+            f'a {largest} row partition takes {summary["single_job_hours"]:.2f} hours which is longer than the '
+            f'{target_hours} hour target. create the partitions with --chunk-size={summary["max_chunk_size"]} or less'
+        )
+    else:
+        print(f'{pods} pods finish in {summary["projected_hours"]:.2f} hours within the {target_hours} hour target')
+
+    print(f'plan written to {plan_folder / "plan.json"}')
+
+    return summary
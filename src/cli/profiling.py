@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+profiling.py
+A module that records the time, memory and rows processed by each cli stage and file
+"""
+
+import cProfile
+import ctypes
+import json
+import os
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from itertools import count
+from pathlib import Path
+from time import perf_counter, process_time
+
+try:
+    import resource
+except ImportError:  #: windows
+    resource = None
+
+#: the settings are stored in the environment so the worker processes of a pool inherit them
+PROFILE_ENV = 'CLI_PROFILE_REPORT'
+CPROFILE_ENV = 'CLI_PROFILE_CPROFILE'
+
+_calls = count()
+#: the highest traced memory of each open measure. a nested measure resets the tracemalloc peak so it hands its
+#: peak back to the measure it is nested in when it exits
+_peaks = []
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    """PROCESS_MEMORY_COUNTERS from psapi.h
+    """
+    _fields_ = [
+        ('cb', ctypes.c_ulong),
+        ('PageFaultCount', ctypes.c_ulong),
+        ('PeakWorkingSetSize', ctypes.c_size_t),
+        ('WorkingSetSize', ctypes.c_size_t),
+        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+        ('PagefileUsage', ctypes.c_size_t),
+        ('PeakPagefileUsage', ctypes.c_size_t),
+    ]
+
+
+def split_profile_arguments(argv):
+    """removes the global profiling options from the command line arguments
+
+    :param argv: The command line arguments
+    :type argv: list[str]
+    :returns: a tuple of the remaining arguments, the report path and if cProfile dumps are wanted
+    :rtype: tuple(list[str], str, bool)
+    """
+    remaining = []
+    report = None
+    dumps = False
+
+    for argument in argv:
+        if argument.startswith('--profile='):
+            report = argument.split('=', 1)[1]
+        elif argument == '--cprofile':
+            dumps = True
+        else:
+            remaining.append(argument)
+
+    return remaining, report, dumps
+
+
+def enable(report, dumps=False):
+    """turns on profiling for this process and the processes it starts
+
+    :param report: The path to the json report to write
+    :type report: Path
+    :param dumps: Write cProfile dumps for the functions decorated with profiled
+    :type dumps: bool
+    """
+    report = Path(report).resolve()
+    report.parent.mkdir(parents=True, exist_ok=True)
+
+    os.environ[PROFILE_ENV] = str(report)
+
+    if dumps:
+        os.environ[CPROFILE_ENV] = 'true'
+
+    events = _events_path()
+    if events.exists():
+        events.unlink()
+
+
+def enabled():
+    """if profiling is turned on
+    """
+    return PROFILE_ENV in os.environ
+
+
+def _events_path():
+    report = Path(os.environ[PROFILE_ENV])
+
+    return report.with_name(f'{report.stem}.events.jsonl')
+
+
+def peak_rss(children=False):
+    """the peak resident memory in bytes of this process or of the largest process it started. On windows the peak
+    working set of this process is used and the child processes are not measured
+
+    :param children: Measure the largest finished child process instead of this process
+    :type children: bool
+    :rtype: int
+    """
+    if resource is None:
+        if children or sys.platform != 'win32':
+            return None
+
+        return _peak_working_set()
+
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        return peak
+
+    return peak * 1024
+
+
+def _peak_working_set():
+    counters = _ProcessMemoryCounters(cb=ctypes.sizeof(_ProcessMemoryCounters))
+    kernel32 = ctypes.WinDLL('kernel32')
+    psapi = ctypes.WinDLL('psapi')
+    kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+    psapi.GetProcessMemoryInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(_ProcessMemoryCounters), ctypes.c_ulong]
+
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+
+    return counters.PeakWorkingSetSize
+
+
+@contextmanager
+def measure(stage, item=None):
+    """records the wall time, cpu time, peak memory and rows processed of the block. Set `rows` on the yielded
+    record to report the rows processed
+
+    :param stage: The name of the stage or function
+    :type stage: str
+    :param item: The file or other item being processed
+    :type item: str
+    """
+    record = {'rows': None}
+
+    if not enabled():
+        yield record
+
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+
+    if started_tracing:
+        tracemalloc.start()
+    else:
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+
+        tracemalloc.reset_peak()
+
+    _peaks.append(0)
+
+    wall = perf_counter()
+    cpu = process_time()
+
+    try:
+        yield record
+    finally:
+        peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)
+
+        record.update({
+            'stage': stage,
+            'item': None if item is None else str(item),
+            'pid': os.getpid(),
+            'wall_seconds': perf_counter() - wall,
+            'cpu_seconds': process_time() - cpu,
+            'peak_traced_bytes': peak,
+            'peak_rss_bytes': peak_rss(),
+        })
+
+        if started_tracing:
+            tracemalloc.stop()
+
+        if record['rows'] is not None and record['wall_seconds'] > 0:
+            record['rows_per_second'] = record['rows'] / record['wall_seconds']
+
+        #: single line appends are safe to share between the worker processes
+        with open(_events_path(), 'a', encoding='utf-8') as events:
+            events.write(json.dumps(record) + '\n')
+
+
+def profiled(stage=None, item=None, rows=None):
+    """measures each call of the decorated function and writes a cProfile dump next to the report when --cprofile
+    is used
+
+    :param stage: The name to report the calls under. Defaults to the function name
+    :type stage: str
+    :param item: A function returning the item being processed from the call arguments
+    :type item: function
+    :param rows: A function returning the rows processed from the return value
+    :type rows: function
+    """
+
+    def decorator(function):
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return function(*args, **kwargs)
+
+            with measure(stage or function.__name__, item(*args, **kwargs) if item else None) as record:
+                if CPROFILE_ENV not in os.environ:
+                    result = function(*args, **kwargs)
+                else:
+                    profile = cProfile.Profile()
+
+                    try:
+                        result = profile.runcall(function, *args, **kwargs)
+                    finally:
+                        report = Path(os.environ[PROFILE_ENV])
+                        profile.dump_stats(
+                            report.with_name(f'{report.stem}-{function.__name__}-{os.getpid()}-{next(_calls)}.prof')
+                        )
+
+                if rows is not None and result is not None:
+                    record['rows'] = rows(result)
+
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def write_report(command):
+    """summarizes the recorded events by stage into the json report
+
+    :param command: The cli command that was run
+    :type command: str
+    """
+    if not enabled():
+        return
+
+    events_path = _events_path()
+    events = []
+
+    if events_path.exists():
+        events = [json.loads(line) for line in events_path.read_text(encoding='utf-8').splitlines() if line]
+
+    stages = {}
+    for event in events:
+        stage = stages.setdefault(
+            event['stage'], {
+                'calls': 0,
+                'wall_seconds': 0,
+                'cpu_seconds': 0,
+                'rows': 0,
+                'peak_traced_bytes': 0,
+                'peak_rss_bytes': 0,
+                'items': []
+            }
+        )
+
+        stage['calls'] += 1
+        stage['wall_seconds'] += event['wall_seconds']
+        stage['cpu_seconds'] += event['cpu_seconds']
+        stage['rows'] += event['rows'] or 0
+        stage['peak_traced_bytes'] = max(stage['peak_traced_bytes'], event['peak_traced_bytes'])
+        stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], event['peak_rss_bytes'] or 0)
+        stage['items'].append(event)
+
+    for stage in stages.values():
+        stage['rows_per_second'] = stage['rows'] / stage['wall_seconds'] if stage['wall_seconds'] > 0 else None
+
+    report = Path(os.environ[PROFILE_ENV])
+    report.write_text(
+        json.dumps({
+            'command': command,
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            'stages': stages
+        }, indent=2),
+        encoding='utf-8'
+    )
+
+    events_path.unlink(missing_ok=True)
+
+    print(f'\nprofile written to {report}')
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+status.py
+A module that summarizes the heartbeats the geocode jobs publish into the progress of the whole cluster
+"""
+
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+
+from .upload import storage_client
+
+HEARTBEAT_FOLDER = 'heartbeats'
+STALE_SECONDS = 300
+STRAGGLER_FACTOR = 2
+
+
+def read_heartbeats(location, service_account=None):
+    """reads the latest heartbeat of every job from a bucket or a local folder
+
+    :param location: A gs://bucket/heartbeats path or a local folder
+    :type location: str
+    :param service_account: The path to the google service account key for a bucket
+    :type service_account: Path
+    :rtype: list[dict]
+    """
+    location = str(location)
+
+    if not location.startswith('gs://'):
+        return [json.loads(item.read_text(encoding='utf-8')) for item in sorted(Path(location).glob('*.json'))]
+
+    bucket_name, _, prefix = location[len('gs://'):].partition('/')
+    return [
+        json.loads(blob.download_as_text())
+        for blob in storage_client(service_account).list_blobs(bucket_name, prefix=prefix or HEARTBEAT_FOLDER)
+        if blob.name.endswith('.json')
+    ]
+
+
+def format_duration(seconds):
+    """a short human readable duration
+    """
+    if seconds is None:
+        return 'unknown'
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return f'{hours}h {minutes}m'
+
+    if minutes:
+        return f'{minutes}m {seconds}s'
+
+    return f'{seconds}s'
+
+
+def summarize(heartbeats, now=None, stale_seconds=STALE_SECONDS):
+    """aggregates the job heartbeats into the overall progress
+
+    - `dead`: running jobs that have not published a heartbeat in stale_seconds
+    - `stragglers`: live jobs that will finish more than STRAGGLER_FACTOR times later than the median job
+    - `eta_seconds`: when the slowest live job is expected to finish
+
+    :param heartbeats: The heartbeats from read_heartbeats
+    :type heartbeats: list[dict]
+    :param now: The time to measure staleness from. Defaults to now
+    :type now: datetime
+    :param stale_seconds: The seconds without a heartbeat before a running job is considered dead
+    :type stale_seconds: int
+    :rtype: dict
+    """
+    now = now or datetime.now(timezone.utc)
+    failures = {}
+    jobs = []
+
+    for heartbeat in heartbeats:
+        age = (now - datetime.fromisoformat(heartbeat['updated'])).total_seconds()
+        remaining = max((heartbeat['total_rows'] or 0) - heartbeat['rows_done'], 0)
+        state = heartbeat['status']
+
+        if state == 'running' and age > stale_seconds:
+            state = 'dead'
+
+        for name, value in heartbeat['failures'].items():
+            failures[name] = failures.get(name, 0) + value
+
+        jobs.append(
+            dict(
+                heartbeat,
+                state=state,
+                age_seconds=age,
+                remaining=remaining,
+                eta_seconds=remaining / heartbeat['rate'] if heartbeat['rate'] > 0 else None
+            )
+        )
+
+    live = [job for job in jobs if job['state'] == 'running']
+    etas = [job['eta_seconds'] for job in live if job['eta_seconds'] is not None]
+    typical = median(etas) if etas else None
+
+    stragglers = [
+        job for job in live if job['eta_seconds'] is None or
+        (typical is not None and len(live) > 1 and job['eta_seconds'] > STRAGGLER_FACTOR * max(typical, 1))
+    ]
+
+    rows_done = sum(job['rows_done'] for job in jobs)
+    total_rows = sum(job['total_rows'] or 0 for job in jobs)
+    throughput = sum(job['rate'] for job in live)
+
+    eta = None
+    if not live:
+        eta = 0
+    elif len(etas) == len(live):
+        eta = max(etas)
+
+    return {
+        'jobs': jobs,
+        'states': {state: sum(job['state'] == state for job in jobs)
+                   for state in sorted({job['state'] for job in jobs})},
+        'rows_done': rows_done,
+        'total_rows': total_rows,
+        'throughput': throughput,
+        'failures': failures,
+        'eta_seconds': eta,
+        'stragglers': stragglers,
+        'dead': [job for job in jobs if job['state'] == 'dead'],
+    }
+
+
+def status(location, stale_seconds=STALE_SECONDS, service_account=None):
+    """prints the overall throughput, eta, stragglers and dead jobs from the job heartbeats
+
+    :param location: A gs://bucket/heartbeats path or a local folder
+    :type location: str
+    :param stale_seconds: The seconds without a heartbeat before a running job is considered dead
+    :type stale_seconds: int
+    :param service_account: The path to the google service account key for a bucket
+    :type service_account: Path
+    :returns: the summary
+    :rtype: dict
+    """
+    heartbeats = read_heartbeats(location, service_account)
+
+    if not heartbeats:
+        print(f'no heartbeats found in {location}')
+
+        return None
+
+    summary = summarize(heartbeats, stale_seconds=stale_seconds)
+    total_rows = summary['total_rows']
+
+    print(f'{len(heartbeats)} jobs: ' + ', '.join(f'{count} {state}' for state, count in summary['states'].items()))
+    print(
+        f'rows: {summary["rows_done"]} of {total_rows} '
+        f'({100 * summary["rows_done"] / max(total_rows, 1):.2f}%)'
+    )
+    print(f'throughput: {summary["throughput"]:.1f} rows per second')
+    print(f'eta: {format_duration(summary["eta_seconds"])}')
+    print('failures: ' + ', '.join(f'{name} {count}' for name, count in summary['failures'].items()))
+
+    if summary['stragglers']:
+        print('\nstragglers')
+
+        for job in summary['stragglers']:
+            print(
+                f'  {job["partition"]} on {job["host"]}: {job["rows_done"]} of {job["total_rows"]} rows at '
+                f'{job["rate"]:.1f} rows per second, eta {format_duration(job["eta_seconds"])}'
+            )
+
+    if summary['dead']:
+        print('\ndead jobs')
+
+        for job in summary['dead']:
+            print(
+                f'  {job["partition"]} on {job["host"]}: no heartbeat for {format_duration(job["age_seconds"])} '
+                f'at row {job["checkpoint"]["row"]} ({job["checkpoint"]["primary_key"]})'
+            )
+
+    return summary
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+store.py
+A module that keeps the geocoded and enhanced results in an embedded sqlite database
+so post mortem, rebase and merge are indexed queries instead of csv folder rewrites
+"""
+
+import csv
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from .enhance import RESULT_COLUMNS, RESULT_CSV_OPTIONS
+from .keys import encode_keys, is_encoded, split_keys
+from .mortem import CSV_OPTIONS, classify_messages
+
+READ_CHUNK_SIZE = 100000
+
+#: bit flags for the message classes so a row can be in more than one post mortem file like the csv outputs
+NOT_FOUND = 1
+API_ERROR = 2
+INCOMPLETE = 4
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS results (
+        type TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        input_address TEXT,
+        input_zone TEXT,
+        score TEXT,
+        x REAL,
+        y REAL,
+        message TEXT,
+        message_class INTEGER NOT NULL DEFAULT 0,
+        encoded INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (type, id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS enhanced (
+        type TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        county_name TEXT,
+        senate_district TEXT,
+        house_district TEXT,
+        census_id TEXT,
+        source TEXT,
+        PRIMARY KEY (type, id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS enhanced_files (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        modified REAL NOT NULL
+    )""",
+]
+
+#: columns added after a store was first created. they are added to older stores when they are opened
+ADDED_COLUMNS = {'results': {'encoded': 'INTEGER NOT NULL DEFAULT 0'}, 'enhanced': {'source': 'TEXT'}}
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS results_score ON results (score)',
+    'CREATE INDEX IF NOT EXISTS results_message_class ON results (message_class)',
+    'CREATE INDEX IF NOT EXISTS enhanced_source ON enhanced (source)',
+]
+
+RESULT_FIELDS = [
+    'type', 'id', 'input_address', 'input_zone', 'score', 'x', 'y', 'message', 'message_class', 'encoded'
+]
+#: the columns the primary key is rebuilt from when the rows are exported
+KEY_FIELDS = 'type, id, encoded'
+#: the scores are stored as they were written by the job so integer scores are not exported as floats.
+#: older stores kept the scores as REAL
+SCORE = (
+    "CASE WHEN typeof(score) = 'real' AND score = CAST(score AS INTEGER) THEN CAST(CAST(score AS INTEGER) AS TEXT) "
+    'ELSE score END AS score'
+)
+
+
+def connect(database):
+    """opens the results store and creates the schema if it does not exist
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :returns: the open connection
+    :rtype: sqlite3.Connection
+    """
+    connection = sqlite3.connect(str(database))
+    connection.execute('PRAGMA journal_mode=WAL')
+
+    for statement in SCHEMA:
+        connection.execute(statement)
+
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+
+        for name, definition in columns.items():
+            if name not in existing:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+    for statement in INDEXES:
+        connection.execute(statement)
+
+    return connection
+
+
+@contextmanager
+def open_store(database):
+    """opens the results store for a block of work. The changes are committed when the block succeeds and the
+    connection is always closed so the WAL files are released
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    """
+    with closing(connect(database)) as connection:
+        with connection:
+            yield connection
+
+
+def split_primary_key(primary_keys):
+    """splits the primary keys into the category character and the numeric id
+
+    :param primary_keys: The concatenated or integer encoded primary keys
+    :type primary_keys: pd.Series
+    :returns: a tuple of the types and the ids
+    :rtype: tuple(pd.Series, pd.Series)
+    """
+    types, ids = split_keys(primary_keys)
+
+    return types, compact_ids(ids)
+
+
+def compact_ids(ids):
+    """converts the ids to integers. ids that are not numbers are stored as text so nothing is lost
+
+    :param ids: The ids without the category character
+    :type ids: pd.Series
+    :rtype: pd.Series
+    """
+    numeric = pd.to_numeric(ids, errors='coerce').astype('Int64')
+
+    return numeric.astype(object).where(numeric.notna(), ids)
+
+
+def _message_classes(messages):
+    not_found, api_errors, incomplete = classify_messages(messages)
+
+    return not_found * NOT_FOUND + api_errors * API_ERROR + incomplete * INCOMPLETE
+
+
+def _result_rows(chunk):
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    chunk['type'], chunk['id'] = split_primary_key(chunk.primary_key)
+    #: integer keys are flagged so they are exported encoded like the csv post mortem writes them
+    chunk['encoded'] = int(is_encoded(chunk.primary_key))
+
+    return chunk[RESULT_FIELDS].itertuples(index=False, name=None)
+
+
+def ingest(database, input_data, separator):
+    """loads the geocoded result csvs into the results store. Rows with a primary key that is already stored
+    are replaced
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param input_data: The folder containing the geocoded result csvs
+    :type input_data: Path
+    :param separator: The csv field separator
+    :type separator: str
+    """
+    files = sorted(Path(input_data).glob('*.csv'))
+    total = 0
+
+    print(f'ingesting {len(files)} files into {database}')
+
+    with open_store(database) as connection:
+        for result in files:
+            print(f'ingesting {result}')
+
+            for chunk in pd.read_csv(
+                result,
+                encoding='utf-8',
+                sep=separator,
+                index_col=False,
+                dtype={
+                    'primary_key': str,
+                    'input_address': str,
+                    'input_zone': str,
+                    'score': str,
+                    'message': str
+                },
+                quoting=csv.QUOTE_MINIMAL,
+                chunksize=READ_CHUNK_SIZE
+            ):
+                chunk['message_class'] = 0
+                errors = chunk.message.notna()
+                chunk.loc[errors, 'message_class'] = _message_classes(chunk.message[errors])
+
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO results ({", ".join(RESULT_FIELDS)}) '
+                    f'VALUES ({", ".join("?" * len(RESULT_FIELDS))})',
+                    _result_rows(chunk)
+                )
+
+                total += len(chunk.index)
+
+    print(f'ingested {total} rows')
+
+
+def breakdown(database):
+    """prints the post mortem breakdown of the unmatched records from the results store
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :returns: the unmatched record counts
+    :rtype: dict
+    """
+    with open_store(database) as connection:
+        total = connection.execute('SELECT COUNT(*) FROM results WHERE message IS NOT NULL').fetchone()[0]
+        unmatchable, api_errors, incomplete = [
+            connection.execute(f'SELECT COUNT(*) FROM results WHERE {_has_class(flag)}').fetchone()[0]
+            for flag in (NOT_FOUND, API_ERROR, INCOMPLETE)
+        ]
+
+    print(f'\ntotal unmatched records: {total}')
+    print('unmatched address breakdown')
+    print(f'  incomplete addresses (missing street or zone): {incomplete}')
+    print(f'  api errors: {api_errors}')
+    print(f'  address not found (bad address or formatting): {unmatchable}')
+
+    return {
+        'total': total,
+        'unmatchable': unmatchable,
+        'api_errors': api_errors,
+        'incomplete': incomplete,
+    }
+
+
+def _has_class(flag):
+    """an IN clause of every message class containing the flag so the message_class index can be used
+    """
+    classes = ', '.join(str(value) for value in range(1, 8) if value & flag)
+
+    return f'message_class IN ({classes})'
+
+
+def with_primary_key(chunk, name='primary_key'):
+    """replaces the type, id and encoded columns of the exported rows with the primary key the geocoded results
+    had. Encoded keys are encoded again so the exports match the csv post mortem
+
+    :param chunk: The exported rows starting with the KEY_FIELDS columns
+    :type chunk: pd.DataFrame
+    :param name: The name of the primary key column
+    :type name: str
+    :rtype: pd.DataFrame
+    """
+    encoded = chunk.encoded.astype(bool)
+    keys = (chunk.type + chunk.id.astype(str)).astype(object)
+
+    if encoded.any():
+        keys[encoded] = encode_keys(chunk.type[encoded], chunk.id[encoded]).astype(str)
+
+    chunk = chunk.drop(columns=['type', 'id', 'encoded'])
+    chunk.insert(0, name, keys)
+
+    return chunk
+
+
+def _export_query(connection, query, destination, key='primary_key', **options):
+    header = True
+
+    with open(destination, 'w', encoding='utf-8', newline='') as output:
+        for chunk in pd.read_sql_query(query, connection, chunksize=READ_CHUNK_SIZE):
+            with_primary_key(chunk, key).to_csv(output, header=header, **options)
+            header = False
+
+        if header:
+            #: write the header for an empty result
+            empty = pd.read_sql_query(f'SELECT * FROM ({query}) LIMIT 0', connection)
+            with_primary_key(empty, key).to_csv(output, header=True, **options)
+
+
+def export_post_mortem(database, output_folder):
+    """writes the post mortem csv files from the results store
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param output_folder: The place to store the post mortem csv's
+    :type output_folder: Path
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    fields = f'{KEY_FIELDS}, input_address, input_zone, {SCORE}, x, y, message'
+    unmatched = f'SELECT {fields} FROM results WHERE message IS NOT NULL'
+
+    exports = {
+        'all_errors.csv': unmatched,
+        'not_found.csv': f'{unmatched} AND {_has_class(NOT_FOUND)}',
+        'api_errors.csv': f'{unmatched} AND {_has_class(API_ERROR)}',
+        'incomplete_errors.csv': f'{unmatched} AND {_has_class(INCOMPLETE)}',
+    }
+
+    with open_store(database) as connection:
+        for name, query in exports.items():
+            print(f'writing {name}')
+
+            _export_query(connection, query, output_folder / name, sep=',', **CSV_OPTIONS)
+
+        export_job(connection, output_folder / 'all_errors_job.csv')
+
+    return breakdown(database)
+
+
+def export_job(connection, destination):
+    """writes the unmatched records in the format that can be processed by the cluster
+
+    :param connection: The open results store
+    :type connection: sqlite3.Connection
+    :param destination: The path to the job csv
+    :type destination: Path
+    """
+    print(f'writing {Path(destination).name}')
+
+    _export_query(
+        connection,
+        f'SELECT {KEY_FIELDS}, input_address AS address, input_zone AS zone FROM results WHERE message IS NOT NULL',
+        destination,
+        key='id',
+        sep='|',
+        **CSV_OPTIONS
+    )
+
+
+def rebase(database, input_data, specific_file, separator, message):
+    """updates the stored results in place with the new geocodes found in the specific_file
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param input_data: The folder containing the geocoded result csvs
+    :type input_data: Path
+    :param specific_file: The pattern matching the geocoded results of a retry job
+    :type specific_file: str
+    :param separator: The csv field separator
+    :type separator: str
+    :param message: The message to mark the rebased rows with
+    :type message: str
+    """
+    retry_csv = [item for item in Path(input_data).glob('*.csv') if item.match(specific_file)][0]
+
+    new_data = pd.read_csv(
+        retry_csv,
+        dtype={
+            'primary_key': str,
+            'input_address': str,
+            'input_zone': str,
+            'score': str
+        },
+        encoding='utf-8',
+        sep=separator,
+        quoting=csv.QUOTE_MINIMAL
+    )
+    new_data = new_data.loc[~(new_data.score == '0')]  #: remove 0 score records
+    new_data = new_data.astype(object).where(new_data.notna(), None)
+    new_data['type'], new_data['id'] = split_primary_key(new_data.primary_key)
+
+    #: the rebased rows are classified like any other message so the breakdown matches the csv post mortem
+    message_class = int(_message_classes(pd.Series([message])).iloc[0])
+
+    print(f'found {len(new_data.index)} records to rebase')
+
+    with open_store(database) as connection:
+        cursor = connection.executemany(
+            """UPDATE results
+            SET input_address = ?, input_zone = ?, score = ?, x = ?, y = ?, message = ?, message_class = ?
+            WHERE type = ? AND id = ?""", [(
+                row.input_address, row.input_zone, row.score, row.x, row.y, message, message_class, row.type,
+                row.id
+            ) for row in new_data.itertuples(index=False)]
+        )
+
+        print(f'rebased {cursor.rowcount} rows')
+
+
+def _file_stat(path):
+    stat = Path(path).stat()
+
+    return stat.st_size, stat.st_mtime
+
+
+def _insert_enhanced(connection, source, rows):
+    rows = rows[RESULT_COLUMNS].astype(object)
+    rows = rows.where(rows.notna(), None)
+    rows['id'] = compact_ids(rows.id.astype(str))
+    rows['source'] = source
+
+    connection.executemany(
+        f'INSERT OR REPLACE INTO enhanced ({", ".join(RESULT_COLUMNS)}, source) '
+        f'VALUES ({", ".join("?" * (len(RESULT_COLUMNS) + 1))})',
+        rows.itertuples(index=False, name=None)
+    )
+
+
+def _record_file(connection, enhanced_csv):
+    connection.execute(
+        'INSERT OR REPLACE INTO enhanced_files VALUES (?, ?, ?)', (Path(enhanced_csv).name, *_file_stat(enhanced_csv))
+    )
+
+
+def _ingest_enhanced_file(connection, enhanced_csv):
+    print(f'ingesting {enhanced_csv}')
+
+    connection.execute('DELETE FROM enhanced WHERE source = ?', (enhanced_csv.name,))
+
+    for chunk in pd.read_csv(
+        enhanced_csv, sep='|', header=None, names=RESULT_COLUMNS, dtype=str, encoding='utf-8', chunksize=READ_CHUNK_SIZE
+    ):
+        _insert_enhanced(connection, enhanced_csv.name, chunk)
+
+    _record_file(connection, enhanced_csv)
+
+
+def write_enhanced(database, enhanced_csv, rows, stale=None):
+    """stores the rows enhance wrote to an enhanced csv so merge does not have to read the csv again. enhance
+    calls this after each file with the rows of the whole file or with the patched rows and their stale keys
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param enhanced_csv: The enhanced csv the rows were written to
+    :type enhanced_csv: Path
+    :param rows: The enhanced rows in the result csv format
+    :type rows: pd.DataFrame
+    :param stale: The primary keys that were patched. None when rows holds every row of the file
+    :type stale: pd.Series
+    """
+    enhanced_csv = Path(enhanced_csv)
+
+    with open_store(database) as connection:
+        known = connection.execute('SELECT 1 FROM enhanced_files WHERE name = ?', (enhanced_csv.name,)).fetchone()
+
+        if stale is None:
+            connection.execute('DELETE FROM enhanced WHERE source = ?', (enhanced_csv.name,))
+        elif known is None:
+            #: a patch is only complete when the rest of the file is already stored
+            _ingest_enhanced_file(connection, enhanced_csv)
+
+            return
+        else:
+            types, ids = split_primary_key(stale.astype(str))
+            connection.executemany('DELETE FROM enhanced WHERE type = ? AND id = ?', zip(types, ids))
+
+        _insert_enhanced(connection, enhanced_csv.name, rows)
+        _record_file(connection, enhanced_csv)
+
+
+def ingest_enhanced(database, final_folder):
+    """loads the enhanced csvs that are not already in the results store or changed since they were stored
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param final_folder: The parent directory of the enhanced csv files
+    :type final_folder: Path
+    """
+    files = sorted(Path(final_folder).glob('*_step_*.csv'))
+
+    with open_store(database) as connection:
+        stored = {
+            name: (size, modified)
+            for name, size, modified in connection.execute('SELECT name, size, modified FROM enhanced_files')
+        }
+        changed = [item for item in files if stored.get(item.name) != _file_stat(item)]
+
+        print(f'{len(files) - len(changed)} of {len(files)} enhanced files are already in the store')
+
+        for enhanced_csv in changed:
+            _ingest_enhanced_file(connection, enhanced_csv)
+
+
+def export_all(database, final_folder):
+    """writes all.csv from the enhanced rows in the results store. Only the enhanced csvs that enhance did not
+    store are read
+
+    :param database: The path to the sqlite database
+    :type database: Path
+    :param final_folder: The parent directory of the enhanced csv files
+    :type final_folder: Path
+    """
+    ingest_enhanced(database, final_folder)
+
+    destination = Path(final_folder) / 'all.csv'
+    print(f'writing {destination}')
+
+    with open_store(database) as connection, open(destination, 'w', encoding='utf-8', newline='') as output:
+        for chunk in pd.read_sql_query(
+            f'SELECT {", ".join(RESULT_COLUMNS)} FROM enhanced ORDER BY type, id',
+            connection,
+            chunksize=READ_CHUNK_SIZE,
+            dtype=str
+        ):
+            chunk.to_csv(output, **RESULT_CSV_OPTIONS)
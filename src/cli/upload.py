@@ -8,15 +8,43 @@ from pathlib import Path
 
 from google.cloud import storage
 
+SERVICE_ACCOUNT = 'gcs-sa.json'
+
+
+def service_account_path(service_account=None):
+    """finds the google service account key. Without a path the key is looked for in the working directory and then
+    next to the cli so the commands work from any folder
+
+    :param service_account: The path to the service account json key
+    :type service_account: Path
+    :rtype: Path
+    """
+    if service_account is not None:
+        candidates = [Path(service_account)]
+    else:
+        candidates = list(dict.fromkeys([Path.cwd() / SERVICE_ACCOUNT, Path(__file__).parent.parent / SERVICE_ACCOUNT]))
+
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+
+    raise FileNotFoundError(
+        f'the google service account key was not found at {", ".join(str(item) for item in candidates)}'
+    )
+
+
+def storage_client(service_account=None):
+    """a google cloud storage client authorized with the service account key
+    """
+    return storage.Client.from_service_account_json(str(service_account_path(service_account)))
+
 
 def upload_files(source_file_name, bucket_name):
     """the main method to be called when the script is invoked
     """
     print(f'uploading {source_file_name} to {bucket_name}')
-    storage_client = storage.Client().from_service_account_json('gcs-sa.json')
-
     name = Path(source_file_name).name
-    bucket = storage_client.get_bucket(bucket_name)
+    bucket = storage_client().get_bucket(bucket_name)
     blob = bucket.blob(name)
 
     blob.upload_from_filename(source_file_name)
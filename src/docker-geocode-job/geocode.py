@@ -6,7 +6,8 @@ Cloud Geocoding
 Usage:
   geocode.py geocode <input_csv>
     (--from-bucket=bucket --output-bucket=output)
-    [--street-field=street --zone-field=zone --id-field=id --testing=test --ignore-failure=failures]
+    [--street-field=street --zone-field=zone --id-field=id --testing=test --ignore-failure=failures --api-url=url]
+    [--heartbeat-interval=seconds]
 
 Options:
   <input_csv>                    The name of the csv inside the --from-bucket
@@ -17,26 +18,30 @@ Options:
   --id-field=id                  The field containing a unique id to zip the results back together [default: id]
   --testing=test                 Trick the tool to not use google data and from and to become file paths [default: false]
   --ignore-failure=failures      Ignore the failure threshold. Useful when trying to geocode garbage data [default: false]
+  --api-url=url                  The base url of the web api [default: http://webapi-api]
+  --heartbeat-interval=seconds   How often the progress is written to the heartbeats folder of the output bucket [default: 30]
 """
 import csv
+import json
 import logging
 import re
+import socket
 import uuid
+from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
 from string import Template
 from time import perf_counter
 
-import google.cloud.logging
 import requests
 from docopt import docopt
 from google.cloud import storage
 
-CLIENT = google.cloud.logging.Client()
-CLIENT.setup_logging()
-
 SPACES = re.compile(r'(\s\d/\d\s)|/|(\s#.*)|%|(\.\s)|\?')
-HOST = 'webapi-api'
+API_URL = 'http://webapi-api'
 HEADER = ('primary_key', 'input_address', 'input_zone', 'score', 'x', 'y', 'message')
+HEARTBEAT_FOLDER = 'heartbeats'
+HEARTBEAT_INTERVAL = 30
 
 
 def make_unique(name):
@@ -82,6 +87,44 @@ def store_job_results(bucket_name, source_file_name, destination_blob_name, test
     logging.info('Upload %s complete', item)
 
 
+def heartbeat_publisher(bucket_name, name, testing):
+    """Creates a function that writes the progress of the job to the heartbeats folder of the bucket
+    """
+    if testing.lower() == 'true':
+        folder = Path(bucket_name) / HEARTBEAT_FOLDER
+        folder.mkdir(parents=True, exist_ok=True)
+
+        return partial(publish_to_folder, folder, name)
+
+    return partial(publish_to_bucket, storage.Client().get_bucket(bucket_name), name)
+
+
+def publish_to_folder(folder, name, heartbeat):
+    """Replaces the heartbeat file in a local folder so a reader never sees a partial write
+    """
+    temp = folder / f'{name}.json.tmp'
+    temp.write_text(json.dumps(heartbeat), encoding='utf-8')
+    temp.replace(folder / f'{name}.json')
+
+
+def publish_to_bucket(bucket, name, heartbeat):
+    """Uploads the heartbeat to the bucket. A failed upload is logged so it does not stop the job
+    """
+    try:
+        bucket.blob(f'{HEARTBEAT_FOLDER}/{name}.json').upload_from_string(
+            json.dumps(heartbeat), content_type='application/json'
+        )
+    except Exception as ex:
+        logging.warning('heartbeat not published: %s', ex)
+
+
+def count_rows(data):
+    """counts the rows in the job csv without the header
+    """
+    with open(data, 'rb') as csv_file:
+        return max(sum(block.count(b'\n') for block in iter(lambda: csv_file.read(1024 * 1024), b'')) - 1, 0)
+
+
 def cleanse_address(data):
     """cleans up address garbage
     """
@@ -139,31 +182,75 @@ def format_time(seconds):
     return f'{round(seconds / hour, 2)} hours'
 
 
-def execute_job(data, options):
-    """loop over the csv data and geocode the rows
+def execute_job(data, options, result='result.csv', heartbeat=None):
+    """loop over the csv data and geocode the rows. heartbeat is called with the progress of the job every
+    --heartbeat-interval seconds
     """
-    url_template = Template(f'http://{HOST}/api/v1/geocode/$street/$zone')
+    api_url = (options.get('--api-url') or API_URL).rstrip('/')
+    url_template = Template(f'{api_url}/api/v1/geocode/$street/$zone')
     sequential_fails = 0
     success = 0
     fail = 0
     score = 0
     total = 0
+    failures = {'not_found': 0, 'api_errors': 0, 'exceptions': 0}
+    primary_key = None
+
+    interval = float(options.get('--heartbeat-interval') or HEARTBEAT_INTERVAL)
+    total_rows = count_rows(data) if heartbeat is not None else None
+    started = datetime.now(timezone.utc)
+    last_beat = {'time': perf_counter(), 'total': 0}
+
+    def beat(status):
+        if heartbeat is None:
+            return
+
+        now = perf_counter()
+        elapsed = now - last_beat['time']
+        running = (datetime.now(timezone.utc) - started).total_seconds()
+
+        heartbeat({
+            'partition': Path(data).stem,
+            'host': socket.gethostname(),
+            'status': status,
+            'started': started.isoformat(timespec='seconds'),
+            'updated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'rows_done': total,
+            'total_rows': total_rows,
+            'rate': (total - last_beat['total']) / elapsed if elapsed > 0 else 0,
+            'average_rate': total / running if running > 0 else 0,
+            'failures': dict(failures),
+            'checkpoint': {
+                'row': total,
+                'primary_key': primary_key
+            },
+        })
+
+        last_beat.update(time=now, total=total)
 
     logging.info('executing job on %s with %s', data, options)
 
-    with open(data, newline='', encoding='utf-8') as csv_file, open('result.csv', 'w', encoding='utf-8') as result_file:
+    with open(data, newline='', encoding='utf-8') as csv_file, open(result, 'w', encoding='utf-8') as result_file:
         reader = csv.DictReader(csv_file, delimiter='|', quoting=csv.QUOTE_NONE)
         writer = csv.writer(result_file)
 
         writer.writerow(HEADER)
 
         start = perf_counter()
+        beat('running')
+
         for row in reader:
+            if perf_counter() - last_beat['time'] >= interval:
+                beat('running')
+
             if options['--testing'].lower() == 'true' and total > 50:
-                return 'result.csv'
+                beat('completed')
+
+                return result
 
             if options['--ignore-failure'].lower() != 'true' and sequential_fails > 25:
                 logging.warning('passed continuous fail threshold. failing entire job.')
+                beat('failed')
 
                 return None
 
@@ -183,6 +270,7 @@ def execute_job(data, options):
                     fail += 1
                     total += 1
                     sequential_fails += 1
+                    failures['not_found' if request.status_code == 404 else 'api_errors'] += 1
 
                     writer.writerow((primary_key, street, zone, 0, 0, 0, response['message']))
 
@@ -211,6 +299,7 @@ def execute_job(data, options):
             except Exception as ex:
                 fail += 1
                 total += 1
+                failures['exceptions'] += 1
 
                 logging.info(ex)
 
@@ -223,24 +312,31 @@ def execute_job(data, options):
                 )
                 start = perf_counter()
 
+        beat('completed')
         logging.info('Job Completed')
         logging.info(
-            'Total requests: %s failure rate: %.2f%% average score: %d time taken: %s', total, (100 * fail / total),
-            score / success, format_time(perf_counter() - start)
+            'Total requests: %s failure rate: %.2f%% average score: %d time taken: %s', total,
+            (100 * fail / max(total, 1)), score / max(success, 1), format_time(perf_counter() - start)
         )
 
-    return 'result.csv'
+    return result
 
 
 def main():
     """the main method to be called when the script is invoked
     """
-    args = docopt(__doc__, version='cloud geocoding job v1.0.2')
-    logging.info('starting job v1.0.2')
+    import google.cloud.logging  #: pylint: disable=import-outside-toplevel
+
+    client = google.cloud.logging.Client()
+    client.setup_logging()
+
+    args = docopt(__doc__, version='cloud geocoding job v1.0.4')
+    logging.info('starting job v1.0.4')
 
     job_data = bring_job_data_local(args['--from-bucket'], args['<input_csv>'], 'job.csv', args['--testing'])
 
-    result = execute_job(job_data, args)
+    heartbeat = heartbeat_publisher(args['--output-bucket'], Path(args['<input_csv>']).stem, args['--testing'])
+    result = execute_job(job_data, args, heartbeat=heartbeat)
 
     store_job_results(args['--output-bucket'], result, args['<input_csv>'], args['--testing'])
 
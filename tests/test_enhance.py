@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_enhance.py
+A module that tests which enhancement layers are copied again and when the results are enhanced again
+"""
+
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cli import enhance  #: pylint: disable=wrong-import-position
+
+
+class FakeWorkspace:
+    """a stand-in for arcpy that holds the source layers and the feature classes that were copied
+    """
+
+    def __init__(self, prefixed):
+        self.layers = {}
+        self.existing = set()
+        self.copied = []
+
+        for layer in enhance.enhancement_layers:
+            name = layer['table'] if prefixed else layer['table'].split('.')[1]
+            self.layers[name] = {'count': 10, 'extent': (1.0, 2.0, 3.0, 4.0), 'edited': None}
+
+        self.arcpy = mock.MagicMock()
+        self.arcpy.Exists.side_effect = lambda name: name in self.layers or name in self.existing
+        self.arcpy.da.Describe.side_effect = self.describe
+        self.arcpy.da.SearchCursor.side_effect = self.search
+        self.arcpy.management.GetCount.side_effect = lambda name: [str(self.layers[name]['count'])]
+        self.arcpy.conversion.FeatureClassToFeatureClass.side_effect = self.copy
+
+    def describe(self, name):
+        layer = self.layers[name]
+
+        return {
+            'extent': SimpleNamespace(**dict(zip(['XMin', 'YMin', 'XMax', 'YMax'], layer['extent']))),
+            'fields': [SimpleNamespace(name='OBJECTID'), SimpleNamespace(name='Shape')],
+            'editorTrackingEnabled': layer['edited'] is not None,
+            'editedAtFieldName': 'last_edited_date',
+        }
+
+    def search(self, name, *_, **__):
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = iter([(self.layers[name]['edited'],)])
+
+        return cursor
+
+    def copy(self, in_features, out_path, out_name, **_):
+        self.copied.append(in_features)
+        self.existing.add(str(Path(out_path) / out_name))
+
+
+def _add_layers(workspace, gdb):
+    with mock.patch.object(enhance, 'arcpy', workspace.arcpy, create=True), \
+            mock.patch.object(enhance, 'filter_mapping'):
+        workspace.copied.clear()
+
+        return enhance.add_enhancement_layers(gdb, gdb.parent / 'source.gdb')
+
+
+def test_get_fingerprint_includes_the_last_edit():
+    workspace = FakeWorkspace(prefixed=False)
+    workspace.layers['county_boundaries']['edited'] = '2024-01-02 03:04:05'
+
+    with mock.patch.object(enhance, 'arcpy', workspace.arcpy, create=True):
+        fingerprint = enhance.get_fingerprint('county_boundaries')
+
+    assert fingerprint == {
+        'count': 10,
+        'extent': [1.0, 2.0, 3.0, 4.0],
+        'fields': ['objectid', 'shape'],
+        'last_edit': '2024-01-02 03:04:05',
+    }
+
+
+@pytest.mark.parametrize('prefixed', [True, False])
+def test_only_the_changed_layers_are_copied_again(tmp_path, prefixed):
+    gdb = tmp_path / enhance.GDB_NAME
+    workspace = FakeWorkspace(prefixed)
+    names = list(workspace.layers)
+
+    assert _add_layers(workspace, gdb) == len(names)
+    assert workspace.copied == names
+
+    assert _add_layers(workspace, gdb) == 0
+    assert not workspace.copied
+
+    workspace.layers[names[1]]['count'] += 1
+
+    assert _add_layers(workspace, gdb) == 1
+    assert workspace.copied == [names[1]]
+
+    #: a layer that is missing from the geodatabase is copied even when its fingerprint did not change
+    workspace.existing.remove(str(gdb / names[2].split('.')[-1]))
+
+    assert _add_layers(workspace, gdb) == 1
+    assert workspace.copied == [names[2]]
+
+    fingerprints = json.loads((tmp_path / enhance.FINGERPRINTS).read_text(encoding='utf-8'))
+
+    assert fingerprints[enhance.enhancement_layers[1]['table']]['count'] == 11
+
+
+def test_enhance_refreshes_every_row_when_the_layers_change(tmp_path):
+    data = tmp_path / 'data'
+    (data / 'enhanced').mkdir(parents=True)
+    (data / 'results').mkdir()
+    fingerprints = data / 'enhanced' / enhance.FINGERPRINTS
+    fingerprints.write_text(json.dumps({'layer': {'count': 1}}), encoding='utf-8')
+
+    geocoded = tmp_path / 'geocoded-results'
+    geocoded.mkdir()
+    pd.DataFrame({
+        'primary_key': ['a1', 'a2'],
+        'score': ['100', '100'],
+        'x': ['1.5', '2.5'],
+        'y': ['3.5', '4.5'],
+        'message': [None, None],
+    }).to_csv(geocoded / 'partition_0.csv', index=False)
+
+    keys = pd.DataFrame({'primary_key': ['a1', 'a2'], 'point_id': [0, 1]})
+    rows = pd.DataFrame([['a', 1, 'SALT LAKE', 1, 2, '1']], columns=enhance.RESULT_COLUMNS)
+
+    def run():
+        with mock.patch.object(enhance, 'arcpy', mock.MagicMock(), create=True), \
+                mock.patch.object(enhance, '__file__', str(tmp_path / 'src' / 'cli' / 'enhance.py')), \
+                mock.patch.object(enhance, 'enhance_data', return_value=('job', keys)) as enhance_data, \
+                mock.patch.object(enhance, 'join_attributes', return_value=rows):
+            enhance.enhance(geocoded)
+
+        return enhance_data.call_count
+
+    assert run() == 1
+    assert run() == 0
+
+    fingerprints.write_text(json.dumps({'layer': {'count': 2}}), encoding='utf-8')
+
+    assert run() == 1
+    assert run() == 0
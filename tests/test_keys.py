@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_keys.py
+A module that tests encoding the category and partial id into integer keys
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cli import keys  #: pylint: disable=wrong-import-position
+
+
+def test_encode_keys_round_trips_through_split_keys():
+    encoded = keys.encode_keys(pd.Series(['a', 'B'], dtype='string'), pd.Series([0, 42], dtype='Int64'))
+
+    assert keys.is_encoded(encoded)
+
+    types, ids = keys.split_keys(encoded.astype(str))
+
+    assert types.tolist() == ['a', 'B']
+    assert ids.tolist() == ['0', '42']
+
+
+@pytest.mark.parametrize(
+    'categories, partial_ids, message', [
+        (['a', None], [1, 2], 'a category on every row'),
+        (['a', ''], [1, 2], 'single character categories'),
+        (['a', 'b'], [1, None], 'a numeric partial id on every row'),
+        (['a', 'b'], ['1', ''], 'a numeric partial id on every row'),
+        (['a', 'b'], ['1', 'x'], 'a numeric partial id on every row'),
+        (['a', 'b'], [1, 2.5], 'whole number partial ids'),
+        (['a', 'b'], [1, -1], 'partial ids between 0'),
+        (['a', 'é'], [1, 2], 'character code of 127 or less'),
+    ]
+)
+def test_encode_keys_rejects_invalid_rows(categories, partial_ids, message):
+    with pytest.raises(ValueError, match=message):
+        keys.encode_keys(pd.Series(categories, dtype=object), pd.Series(partial_ids, dtype=object))
+
+
+def test_text_keys_are_not_encoded():
+    assert not keys.is_encoded(pd.Series(['a1', 'b2']))
+    assert not keys.is_encoded(pd.Series(['1', '2']))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_mortem.py
+A module that tests rebasing retry results into the result csvs
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cli import mortem  #: pylint: disable=wrong-import-position
+
+MESSAGE = 'post mortem replaced'
+
+
+def test_rebase_reads_the_keys_with_the_separator(tmp_path):
+    pd.DataFrame({
+        'primary_key': ['a1', 'a2', 'a3'],
+        'input_address': ['1 MAIN ST', '2 MAIN ST', '3 MAIN ST'],
+        'input_zone': '84101',
+        'score': ['100', '0', '0'],
+        'x': ['1.5', '0', '0'],
+        'y': ['2.5', '0', '0'],
+        'message': [None, 'not found', 'not found'],
+    }).to_csv(tmp_path / 'result_0.csv', sep='|', index=False)
+
+    pd.DataFrame({
+        'primary_key': ['a2', 'a3'],
+        'input_address': ['2 MAIN ST', '3 MAIN ST'],
+        'input_zone': '84101',
+        'score': ['90', '0'],
+        'x': ['3.5', '0'],
+        'y': ['4.5', '0'],
+        'message': [None, 'not found'],
+    }).to_csv(tmp_path / 'retry-all_errors_job.csv', sep='|', index=False)
+
+    mortem.rebase(tmp_path, 'retry-all_errors_job.csv', '|', MESSAGE)
+
+    rebased = pd.read_csv(tmp_path / 'result_0.csv', sep='|', dtype=str, index_col='primary_key')
+
+    assert list(rebased.columns) == ['input_address', 'input_zone', 'score', 'x', 'y', 'message']
+    assert rebased.loc['a2', 'score'] == '90'
+    assert rebased.loc['a2', 'message'] == MESSAGE
+    assert rebased.loc['a3', 'message'] == 'not found'
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_store.py
+A module that compares the results store with the csv post mortem and rebase
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cli import keys, mortem, store  #: pylint: disable=wrong-import-position
+
+NOT_FOUND = 'No address candidates found with a score of 70 or better.'
+MESSAGE = 'post mortem replaced'
+
+
+def _write_results(folder, integer_keys):
+    """writes two geocoded result files where every third row was not found
+    """
+    folder.mkdir(parents=True)
+
+    for part in range(2):
+        ids = pd.Series(range(part * 10, part * 10 + 10))
+        categories = pd.Series(['a', 'b'] * 5)
+        primary_keys = categories + ids.astype(str)
+
+        if integer_keys:
+            primary_keys = keys.encode_keys(categories, ids).astype(str)
+
+        unmatched = ids % 3 == 0
+
+        pd.DataFrame({
+            'primary_key': primary_keys,
+            'input_address': [f'{value} MAIN ST' for value in ids],
+            'input_zone': '84101',
+            'score': unmatched.map({True: 0, False: 100}),
+            'x': unmatched.map({True: 0.0, False: 423606.5}),
+            'y': unmatched.map({True: 0.0, False: 4500000.25}),
+            'message': unmatched.map({True: NOT_FOUND, False: None}),
+        }).to_csv(folder / f'result_{part}.csv', index=False)
+
+
+def _retry_results(job_csv, destination):
+    """geocodes every row of a retry job
+    """
+    job = pd.read_csv(job_csv, sep='|', dtype=str)
+
+    pd.DataFrame({
+        'primary_key': job.id,
+        'input_address': job.address,
+        'input_zone': job.zone,
+        'score': 100,
+        'x': 1.5,
+        'y': 2.5,
+        'message': None,
+    }).to_csv(destination, index=False)
+
+
+def _read_sorted(csv_file, separator=','):
+    data = pd.read_csv(csv_file, sep=separator, dtype=str, keep_default_na=False)
+
+    return data.sort_values(list(data.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('integer_keys', [False, True])
+def test_store_post_mortem_matches_csv_post_mortem(tmp_path, integer_keys):
+    results = tmp_path / 'results'
+    _write_results(results, integer_keys)
+
+    mortem.mortem(results, tmp_path / 'csv', ',')
+
+    database = tmp_path / 'results.db'
+    store.ingest(database, results, ',')
+    store.export_post_mortem(database, tmp_path / 'store')
+
+    for name in ['all_errors.csv', 'not_found.csv', 'api_errors.csv', 'incomplete_errors.csv']:
+        pd.testing.assert_frame_equal(_read_sorted(tmp_path / 'csv' / name), _read_sorted(tmp_path / 'store' / name))
+
+    pd.testing.assert_frame_equal(
+        _read_sorted(tmp_path / 'csv' / 'all_errors_job.csv', '|'),
+        _read_sorted(tmp_path / 'store' / 'all_errors_job.csv', '|')
+    )
+
+
+@pytest.mark.parametrize('integer_keys', [False, True])
+def test_retry_rebases_the_same_rows_through_the_store_and_csv(tmp_path, integer_keys):
+    results = tmp_path / 'results'
+    _write_results(results, integer_keys)
+
+    database = tmp_path / 'results.db'
+    store.ingest(database, results, ',')
+    store.export_post_mortem(database, tmp_path / 'store')
+
+    #: the retry job exported by the store is geocoded and rebased into the csv results and the store
+    _retry_results(tmp_path / 'store' / 'all_errors_job.csv', results / 'retry-all_errors_job.csv')
+
+    mortem.rebase(results, 'retry-all_errors_job.csv', ',', MESSAGE)
+    store.rebase(database, results, 'retry-all_errors_job.csv', ',', MESSAGE)
+
+    rebased = pd.concat([_read_sorted(item) for item in sorted(results.glob('result_*.csv'))], ignore_index=True)
+    unmatched = len(pd.read_csv(tmp_path / 'store' / 'all_errors_job.csv', sep='|').index)
+
+    assert unmatched > 0
+    assert (rebased.message == MESSAGE).sum() == unmatched
+
+    #: the rebased rows keep a message so both post mortems still list them
+    mortem.mortem(results, tmp_path / 'csv', ',')
+    store.export_post_mortem(database, tmp_path / 'rebased')
+
+    pd.testing.assert_frame_equal(
+        _read_sorted(tmp_path / 'csv' / 'all_errors.csv'), _read_sorted(tmp_path / 'rebased' / 'all_errors.csv')
+    )